@@ -1 +1,5 @@
-from .registry import *
\ No newline at end of file
+from .registry import *
+from .worker_init import *
+from .collate import *
+from .autotune import *
+from .prefetcher import *
@@ -0,0 +1,109 @@
+import os
+import time
+import logging
+from prettytable import PrettyTable
+from seg.utils.distribute import broadcast_object
+
+
+def _batch_size(batch):
+    if isinstance(batch, dict):
+        batch = batch.get('image', next(iter(batch.values())))
+    if isinstance(batch, (list, tuple)):
+        return _batch_size(batch[0]) if len(batch) > 0 and not hasattr(batch[0], 'shape') else len(batch)
+    return batch.shape[0] if hasattr(batch, 'shape') else 1
+
+
+def probe_dataloader(dataloader, num_batches=20, warmup=2):
+    """Iterate ``num_batches`` batches and measure the loader throughput.
+
+    The first ``warmup`` batches (worker start-up, first decode) are not counted.
+
+    Returns:
+        tuple[float, float]: Samples per second and mean wait per batch in ms.
+    """
+    iterator = iter(dataloader)
+    samples, waited, counted = 0, 0., 0
+    start = time.perf_counter()
+    for i in range(num_batches + warmup):
+        t0 = time.perf_counter()
+        try:
+            batch = next(iterator)
+        except StopIteration:
+            break
+        if i == warmup - 1:
+            start = time.perf_counter()
+        if i < warmup:
+            continue
+        waited += time.perf_counter() - t0
+        samples += _batch_size(batch)
+        counted += 1
+    elapsed = time.perf_counter() - start
+    del iterator
+    return samples / max(elapsed, 1e-9), waited / max(counted, 1) * 1000
+
+
+class DataLoaderAutoTune:
+    """Pick ``workers_per_gpu`` and ``prefetch_factor`` by probing a small grid.
+
+    Every candidate DataLoader is built with ``build_fn(workers_per_gpu, prefetch_factor)``
+    and iterated for ``num_batches`` batches without any model in the loop, so the
+    measurement is the upper bound the loader can feed. The fastest setting wins;
+    settings within ``tolerance`` of it are considered equal and the one with fewer
+    workers (less memory, less CPU contention with the training process) is taken.
+    Under DDP every rank probes, so the measurement includes the contention of the
+    other ranks' loaders, and the choice of rank 0 is broadcast to all ranks.
+
+    Args:
+        workers (list[int], optional): Candidate ``workers_per_gpu``. Defaults to
+            powers of two up to the cpus of this rank.
+        prefetch_factors (list[int]): Candidate ``prefetch_factor``. Defaults to (2, 4).
+        num_batches (int): Measured batches per candidate. Defaults to 20.
+        warmup (int): Unmeasured batches per candidate. Defaults to 2.
+        tolerance (float): Relative throughput margin treated as a tie. Defaults to 0.05.
+        local_world_size (int): Ranks sharing the node, used for the default grid.
+    """
+
+    def __init__(self, workers=None, prefetch_factors=(2, 4), num_batches=20, warmup=2, tolerance=0.05,
+                 local_world_size=1):
+        if workers is None:
+            cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+            cpus = max(cpus // max(local_world_size, 1), 1)
+            workers = [0] + [2 ** i for i in range(cpus.bit_length()) if 2 ** i <= cpus]
+        self.workers = sorted(set(workers))
+        self.prefetch_factors = sorted(set(prefetch_factors))
+        self.num_batches = num_batches
+        self.warmup = warmup
+        self.tolerance = tolerance
+        self.results = []
+
+    def candidates(self):
+        for workers in self.workers:
+            # prefetch_factor 只对多进程加载有效
+            for prefetch_factor in (self.prefetch_factors if workers > 0 else [None]):
+                yield workers, prefetch_factor
+
+    def __call__(self, build_fn, logger=None):
+        logger = logger or logging.getLogger()
+        self.results = []
+        for workers, prefetch_factor in self.candidates():
+            dataloader = build_fn(workers, prefetch_factor)
+            samples_per_sec, wait_ms = probe_dataloader(dataloader, self.num_batches, self.warmup)
+            del dataloader
+            self.results.append((workers, prefetch_factor, samples_per_sec, wait_ms))
+
+        best = max(r[2] for r in self.results)
+        choice = min((r for r in self.results if r[2] >= best * (1 - self.tolerance)),
+                     key=lambda r: (r[0], r[1] or 0))
+        # 所有 rank 使用 rank 0 的选择, 保存的运行配置与每个 rank 实际使用的一致
+        choice = broadcast_object(choice)
+        self.log(logger, choice)
+        return choice[0], choice[1]
+
+    def log(self, logger, choice):
+        table = PrettyTable()
+        table.field_names = ["workers_per_gpu", "prefetch_factor", "samples/s", "wait(ms)", "chosen"]
+        for r in self.results:
+            table.add_row([r[0], r[1], round(r[2], 1), round(r[3], 2), '*' if r[:2] == choice[:2] else ''])
+        logger.info(f"DataLoader auto-tune over {self.num_batches} batches per setting")
+        for msg in table.__str__().split('\n'):
+            logger.info(msg)
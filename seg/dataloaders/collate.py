@@ -0,0 +1,94 @@
+import math
+import torch
+import torch.nn.functional as F
+from torch.utils.data.dataloader import default_collate
+from .registry import COLLATES
+
+
+@COLLATES.register_module()
+class PaddedCollate:
+    """Collate samples of different spatial size by padding them to a common shape.
+
+    The batch is padded to its largest sample rounded up to ``size_divisor``, images
+    on the bottom/right with ``pad_value`` and masks with ``ignore_label`` so the
+    padding does not contribute to the loss. Other keys use the default collate.
+
+    Args:
+        ignore_label (int): Fill value of padded mask pixels. Defaults to -100, the
+            default ``ignore_label`` of ``CrossEntropyLoss``.
+        pad_value (float): Fill value of padded image pixels. Defaults to 0.
+        size_divisor (int): The padded shape is a multiple of it. Defaults to 32.
+    """
+
+    def __init__(self, ignore_label=-100, pad_value=0., size_divisor=32):
+        self.ignore_label = ignore_label
+        self.pad_value = pad_value
+        self.size_divisor = size_divisor
+
+    def _pad(self, tensors, value):
+        height = max(t.shape[-2] for t in tensors)
+        width = max(t.shape[-1] for t in tensors)
+        height = int(math.ceil(height / self.size_divisor) * self.size_divisor)
+        width = int(math.ceil(width / self.size_divisor) * self.size_divisor)
+        return torch.stack([
+            F.pad(t, (0, width - t.shape[-1], 0, height - t.shape[-2]), value=value) for t in tensors])
+
+    def __call__(self, batch):
+        padded = dict()
+        if 'image' in batch[0]:
+            padded['image'] = self._pad([b.pop('image') for b in batch], self.pad_value)
+        if 'mask' in batch[0]:
+            padded['mask'] = self._pad([b.pop('mask') for b in batch], self.ignore_label)
+        padded.update(default_collate(batch))
+        return padded
+
+
+@COLLATES.register_module()
+class ShmRingCollate:
+    """Collate into a fixed ring of preallocated shared-memory batch slots.
+
+    The default collate allocates a new shared-memory segment for every tensor of
+    every batch in the worker. Here each worker allocates, on its first batch, a
+    ring of ``ring_size`` slots per key in ``keys`` and writes the samples of batch ``k``
+    into slot ``k % ring_size``. The returned tensors are views of already shared
+    storages, so sending them to the main process only pickles a storage handle,
+    which torch maps once and then serves from its shared-storage cache.
+
+    A slot is overwritten ``ring_size`` batches later, so the consumer must be done
+    with a batch by then: keep ``ring_size >= prefetch_factor + 2`` and copy the
+    batch to the device (or let ``pin_memory`` copy it) before the next step.
+    Consumers must not keep references to the ring tensors across steps; copy
+    whatever is retained. Only the large per-pixel ``keys`` go through the ring,
+    the other keys (e.g. ``index`` or ``timing``) and samples that are not tensors
+    of one shape fall back to the default collate.
+
+    Args:
+        ring_size (int): Slots per worker and key. Defaults to 4.
+        keys (Sequence[str]): Keys collated into the ring. Defaults to ('image', 'mask').
+    """
+
+    def __init__(self, ring_size=4, keys=('image', 'mask')):
+        self.ring_size = ring_size
+        self.keys = tuple(keys)
+        self.rings = dict()
+        self.counter = 0
+
+    def _slot(self, key, samples):
+        elem = samples[0]
+        ring = self.rings.get(key, None)
+        if ring is None or ring.shape[2:] != elem.shape or ring.dtype != elem.dtype or ring.shape[1] < len(samples):
+            ring = torch.empty((self.ring_size, len(samples), *elem.shape), dtype=elem.dtype).share_memory_()
+            self.rings[key] = ring
+        return ring[self.counter % self.ring_size, :len(samples)]
+
+    def __call__(self, batch):
+        collated = dict()
+        for key in batch[0]:
+            samples = [b[key] for b in batch]
+            if key in self.keys and all(
+                    isinstance(s, torch.Tensor) and s.shape == samples[0].shape for s in samples):
+                collated[key] = torch.stack(samples, out=self._slot(key, samples))
+            else:
+                collated[key] = default_collate(samples)
+        self.counter += 1
+        return collated
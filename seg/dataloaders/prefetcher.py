@@ -0,0 +1,86 @@
+import time
+import torch
+
+
+class DevicePrefetcher:
+    """Wrap a DataLoader and stage the next batch on the device while the current one runs.
+
+    On CUDA the host-to-device copy of batch ``i + 1`` is issued on a side stream
+    right before batch ``i`` is returned, from pinned memory so the copy is truly
+    asynchronous, and the compute stream waits for it only when the batch is used.
+    On other devices the batches are moved synchronously, so the same training
+    loop runs unchanged in CPU-only environments. Attributes that are not defined
+    here (``dataset``, ``sampler``, ``batch_sampler``...) are read from the DataLoader.
+    ``copy_time`` holds the copy time of the batch last returned, a (start, end)
+    pair of cuda events on the side stream or a number of seconds otherwise.
+
+    Args:
+        dataloader (DataLoader): Loader yielding dict batches.
+        device (str | torch.device): Target device.
+        keys (Sequence[str]): Batch entries moved to the device, the others stay on
+            the host. Defaults to ('image', 'mask').
+        transform (callable, optional): Host-side batch transform applied before the
+            copy, e.g. a :class:`BatchCompose` running on cpu.
+    """
+
+    def __init__(self, dataloader, device, keys=('image', 'mask'), transform=None):
+        self.dataloader = dataloader
+        self.device = torch.device(device)
+        self.keys = keys
+        self.transform = transform
+        self.use_stream = self.device.type == 'cuda' and torch.cuda.is_available()
+        self.stream = torch.cuda.Stream(device=self.device) if self.use_stream else None
+        # DataLoader 已经 pin_memory 时不再重复拷贝
+        self.pin_memory = self.use_stream and not getattr(dataloader, 'pin_memory', False)
+        self.copy_time = None
+
+    def __getattr__(self, name):
+        if name == 'dataloader':
+            raise AttributeError(name)
+        return getattr(self.dataloader, name)
+
+    def __len__(self):
+        return len(self.dataloader)
+
+    def _to_device(self, batch):
+        for key in self.keys:
+            value = batch.get(key, None)
+            if not isinstance(value, torch.Tensor):
+                continue
+            if self.pin_memory and not value.is_pinned():
+                value = value.pin_memory()
+            batch[key] = value.to(self.device, non_blocking=self.use_stream)
+        return batch
+
+    def _stage(self, iterator):
+        try:
+            batch = next(iterator)
+        except StopIteration:
+            return None, None
+        if self.transform is not None:
+            batch = self.transform(**batch)
+        if self.stream is None:
+            t0 = time.perf_counter()
+            batch = self._to_device(batch)
+            return batch, time.perf_counter() - t0
+        with torch.cuda.stream(self.stream):
+            start, end = torch.cuda.Event(enable_timing=True), torch.cuda.Event(enable_timing=True)
+            start.record(self.stream)
+            batch = self._to_device(batch)
+            end.record(self.stream)
+            return batch, (start, end)
+
+    def __iter__(self):
+        iterator = iter(self.dataloader)
+        next_batch, next_copy_time = self._stage(iterator)
+        while next_batch is not None:
+            batch, self.copy_time = next_batch, next_copy_time
+            if self.stream is not None:
+                current_stream = torch.cuda.current_stream(self.device)
+                current_stream.wait_stream(self.stream)
+                for key in self.keys:
+                    if isinstance(batch.get(key, None), torch.Tensor):
+                        # 张量在侧流上分配, 告知缓存分配器它也被计算流使用
+                        batch[key].record_stream(current_stream)
+            next_batch, next_copy_time = self._stage(iterator)
+            yield batch
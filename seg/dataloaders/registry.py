@@ -1,14 +1,72 @@
+import os
 from seg.utils.registry import Registry, build_from_cfg
-from torch.utils.data import DataLoader
+from seg.datasets.registry import build_sampler
+from seg.datasets.samplers import ResumableBatchSampler
+from torch.utils.data import DataLoader, BatchSampler
+from .worker_init import ThreadBudget
+from .autotune import DataLoaderAutoTune
 
 DATALOADERS = Registry('dataloader')
 DATALOADERS.register_module('DataLoader', module=DataLoader)
+COLLATES = Registry('collate')
 
 
-def build_dataloader(cfg, num_gpus, distributed, default_args=None):
+def build_collate(cfg, default_args=None):
+    return build_from_cfg(cfg, COLLATES, default_args)
+
+
+def build_dataloader(cfg, num_gpus, distributed, default_args=None, default_sampler=None, resumable=False):
+    """Build a DataLoader from ``cfg``.
+
+    With ``resumable`` the batches come from a :class:`ResumableBatchSampler`, and
+    without a configured sampler the order is drawn by ``DistributSampler`` from
+    ``(seed, epoch)`` even on one process, so an epoch can be resumed mid-way.
+
+    When ``distributed`` and ``cfg`` configures neither ``sampler`` nor ``batch_sampler``,
+    ``default_sampler`` (``DistributSampler`` if None) shards the dataset across ranks.
+
+    With an ``autotune`` entry (``true`` or the arguments of :class:`DataLoaderAutoTune`)
+    ``workers_per_gpu`` and ``prefetch_factor`` are chosen by a short probe. The choice
+    is written back into ``cfg`` and ``autotune`` is removed from it, so a run config
+    saved afterwards reproduces the run without probing again.
+    """
+    autotune = cfg.pop('autotune', None)
+    if autotune:
+        autotune = dict() if autotune is True else dict(autotune)
+        if distributed:
+            autotune.setdefault('local_world_size', int(os.environ.get('LOCAL_WORLD_SIZE', num_gpus)))
+        tuner = DataLoaderAutoTune(**autotune)
+
+        def build_fn(workers_per_gpu, prefetch_factor):
+            cfg_ = dict(cfg, workers_per_gpu=workers_per_gpu)
+            cfg_.pop('prefetch_factor', None)
+            cfg_.pop('persistent_workers', None)
+            if prefetch_factor is not None:
+                cfg_['prefetch_factor'] = prefetch_factor
+            return _build_dataloader(cfg_, num_gpus, distributed, default_args, default_sampler, resumable)
+
+        workers_per_gpu, prefetch_factor = tuner(build_fn)
+        cfg['workers_per_gpu'] = workers_per_gpu
+        if prefetch_factor is None:
+            cfg.pop('prefetch_factor', None)
+            cfg.pop('persistent_workers', None)
+        else:
+            cfg['prefetch_factor'] = prefetch_factor
+    return _build_dataloader(cfg, num_gpus, distributed, default_args, default_sampler, resumable)
+
+
+def _build_dataloader(cfg, num_gpus, distributed, default_args=None, default_sampler=None, resumable=False):
     cfg_ = cfg.copy()
+    # 没有 GPU 时 (devices_count() 为 0) 按单个设备构建, CPU 上走同一条代码路径
+    num_gpus = max(num_gpus, 1)
     samples_per_gpu = cfg_.pop('samples_per_gpu')
     workers_per_gpu = cfg_.pop('workers_per_gpu')
+    thread_budget = cfg_.pop('thread_budget', None)
+    sampler = cfg_.pop('sampler', None)
+    batch_sampler = cfg_.pop('batch_sampler', None)
+    collate = cfg_.pop('collate', None)
+    if distributed and sampler is None and batch_sampler is None:
+        sampler = default_sampler or dict(type='DistributSampler')
     if distributed:
         batch_size = samples_per_gpu
         num_workers = workers_per_gpu
@@ -18,6 +76,48 @@ def build_dataloader(cfg, num_gpus, distributed, default_args=None):
 
     cfg_.update({'batch_size': batch_size, 'num_workers': num_workers})
 
+    if thread_budget is not None and num_workers > 0:
+        thread_budget = dict() if thread_budget is True else dict(thread_budget)
+        if distributed:
+            thread_budget.setdefault('local_world_size', int(os.environ.get('LOCAL_WORLD_SIZE', num_gpus)))
+            thread_budget.setdefault('local_rank', int(os.environ.get('LOCAL_RANK', 0)))
+        worker_init_fn = ThreadBudget(num_workers, worker_init_fn=cfg_.get('worker_init_fn'), **thread_budget)
+        worker_init_fn.log()
+        cfg_['worker_init_fn'] = worker_init_fn
+
+    if collate is not None:
+        if collate.get('type') == 'ShmRingCollate':
+            # worker 最多领先 prefetch_factor 个 batch, 再留出主进程正在使用的 slot
+            collate = dict(collate)
+            collate.setdefault('ring_size', (cfg_.get('prefetch_factor') or 2) + 2)
+        cfg_['collate_fn'] = build_collate(collate)
+
+    default_args = dict() if default_args is None else default_args.copy()
+    if batch_sampler is not None:
+        # batch_sampler 与 batch_size/shuffle/drop_last 互斥, 交给采样器处理
+        shuffle = default_args.pop('shuffle', cfg_.pop('shuffle', False))
+        cfg_.pop('shuffle', None)
+        cfg_['batch_sampler'] = build_sampler(batch_sampler, dict(
+            dataset=default_args['dataset'], batch_size=cfg_.pop('batch_size'),
+            shuffle=shuffle, drop_last=cfg_.pop('drop_last', False)))
+    elif sampler is not None:
+        # sampler 与 shuffle 互斥, 交给采样器处理
+        shuffle = default_args.pop('shuffle', cfg_.pop('shuffle', False))
+        cfg_.pop('shuffle', None)
+        cfg_['sampler'] = build_sampler(sampler, dict(dataset=default_args['dataset'], shuffle=shuffle))
+
+    if resumable:
+        # 断点续训: 采样顺序只由 (seed, epoch) 决定, 并且可以跳过 epoch 开头已训练的 batch
+        if 'batch_sampler' not in cfg_:
+            if 'sampler' not in cfg_:
+                shuffle = default_args.pop('shuffle', cfg_.pop('shuffle', False))
+                cfg_.pop('shuffle', None)
+                cfg_['sampler'] = build_sampler(dict(type='DistributSampler'),
+                                                dict(dataset=default_args['dataset'], shuffle=shuffle))
+            cfg_['batch_sampler'] = BatchSampler(cfg_.pop('sampler'), cfg_.pop('batch_size'),
+                                                 cfg_.pop('drop_last', False))
+        cfg_['batch_sampler'] = ResumableBatchSampler(cfg_['batch_sampler'])
+
     dataloader = build_from_cfg(cfg_, DATALOADERS, default_args)
 
     return dataloader
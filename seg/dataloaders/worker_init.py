@@ -0,0 +1,58 @@
+import os
+import logging
+import cv2
+import torch
+
+
+class ThreadBudget:
+    """Worker init hook that splits a node-wide CPU budget across DataLoader workers.
+
+    Every worker process otherwise starts OpenCV and torch intra-op pools sized to
+    the whole machine, so ``workers x ranks`` processes oversubscribe the node.
+    The budget is first split between the ranks running on this node, then between
+    the workers of one rank.
+
+    Args:
+        num_workers (int): Workers of this DataLoader.
+        cpus (int, optional): CPU budget of the whole node. Defaults to the cpus
+            available to this process.
+        local_world_size (int): Ranks sharing the node. Defaults to 1.
+        local_rank (int): Rank index on the node. Defaults to 0.
+        affinity (bool): Whether to pin each worker to its own cpu slice.
+            Only supported on Linux. Defaults to False.
+        worker_init_fn (callable, optional): User hook called after the budget is set.
+    """
+
+    def __init__(self, num_workers, cpus=None, local_world_size=1, local_rank=0, affinity=False,
+                 worker_init_fn=None):
+        if cpus is None:
+            cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+        self.cpus = cpus
+        self.num_workers = max(num_workers, 1)
+        self.local_world_size = max(local_world_size, 1)
+        self.local_rank = local_rank
+        self.affinity = affinity and hasattr(os, 'sched_setaffinity')
+        self.worker_init_fn = worker_init_fn
+
+        self.rank_cpus = max(self.cpus // self.local_world_size, 1)
+        self.threads_per_worker = max(self.rank_cpus // self.num_workers, 1)
+
+    def cpu_slice(self, worker_id):
+        available = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') \
+            else list(range(os.cpu_count()))
+        start = self.local_rank * self.rank_cpus + worker_id * self.threads_per_worker
+        return [available[(start + i) % len(available)] for i in range(self.threads_per_worker)]
+
+    def log(self, logger=None):
+        logger = logger or logging.getLogger()
+        logger.info(f"Thread budget: {self.cpus} cpus, {self.local_world_size} local ranks x "
+                    f"{self.num_workers} workers, {self.threads_per_worker} opencv/torch threads per worker, "
+                    f"cpu affinity: {self.affinity}")
+
+    def __call__(self, worker_id):
+        cv2.setNumThreads(self.threads_per_worker)
+        torch.set_num_threads(self.threads_per_worker)
+        if self.affinity:
+            os.sched_setaffinity(0, self.cpu_slice(worker_id))
+        if self.worker_init_fn is not None:
+            self.worker_init_fn(worker_id)
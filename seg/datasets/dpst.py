@@ -1,6 +1,6 @@
 import os
 from torch.utils.data import Dataset
-from seg.utils.io import IMAGE_POSTFIX, opj, ope, load_json, annotation2mask, read_image
+from seg.utils.io import IMAGE_POSTFIX, opj, ope, load_json, annotation2mask, annotation2boxes, read_image
 from seg.transforms import Compose
 from seg.loggers import build_logger
 from .registry import DATASETS
@@ -29,6 +29,8 @@ class DPST(Dataset):
         self._label_class_dict = self.get_label_class_dict()
         self.label_set = set()
         self.data_info = []
+        self.image_shapes = []  # (height, width), 从标注读取, 供分桶采样使用
+        self.image_label_sets = []  # 每张图包含的类别, 供 RepeatFactorSampler 统计类别频率
         self.load_data_paths()
         self.length = len(self.data_info)
 
@@ -50,9 +52,13 @@ class DPST(Dataset):
                     raise f"self.shape_labels are {self.shape_labels}, but got unknown label: {label} in {jp}, please check json info or configs"
             data_info = {
                 'ip': ip,
-                'json_info': json_info
+                'json_info': json_info,
+                # 每类目标框, 供 RandomCrop(crop_object=True) 直接采样裁剪中心
+                'fg_index': annotation2boxes(json_info, self.class2label)
             }
             self.data_info.append(data_info)
+            self.image_shapes.append((int(json_info['height']), int(json_info['width'])))
+            self.image_label_sets.append(sorted(label_set))
 
         self.logger.info(f"Loaded {self.mode} Dataset {len(self.data_info)} images, label class: {len(self.label_set)}")
 
@@ -70,7 +76,7 @@ class DPST(Dataset):
     def label2class(self):
         return self._label_class_dict
 
-    def prepare_one_data(self, item):
+    def prepare_one_data(self, item, target_size=None):
         data_info = self.data_info[item].copy()
         ip = data_info.pop('ip')
         json_info = data_info.pop('json_info')
@@ -78,6 +84,8 @@ class DPST(Dataset):
         mask = annotation2mask(json_info, self.class2label)
         data_info['image'] = image
         data_info['mask'] = mask
+        if target_size is not None:
+            data_info['target_size'] = tuple(target_size)
         return data_info
 
     def parse_json_info(self, json_info):
@@ -93,10 +101,25 @@ class DPST(Dataset):
     # def prepare_data(self, data_info):
     #     return data_info.pop('image'), data_info.pop('mask')
 
+    def sample_key(self, item):
+        # 标签映射会改变 annotation2mask 的结果, 因此也放进缓存 key
+        return f"{self.data_info[item]['ip']}|{sorted(self.class2label.items())}"
+
     def __getitem__(self, item):
-        data_info = self.prepare_one_data(item)
-        if self.transform:
-            data_info = self.transform(**data_info)
+        target_size = None
+        if isinstance(item, (tuple, list)):
+            # MultiScaleBatchSampler 传入 (index, (height, width))
+            item, target_size = item
+        if self.transform and getattr(self.transform, 'cache', None) is not None:
+            data_info = self.transform.cached_call(
+                f"{self.sample_key(item)}|{target_size}", self.prepare_one_data, item, target_size)
+        else:
+            data_info = self.prepare_one_data(item, target_size)
+            if self.transform:
+                data_info = self.transform(**data_info)
+        if data_info is not None:
+            # ImportanceSampler 依据样本索引记录损失
+            data_info['index'] = item
         return data_info
 
 
@@ -1,4 +1,7 @@
+import logging
+import numpy as np
 import torch
+import torch.distributed as dist
 from torch.utils.data import Sampler
 from torch.utils.data import DistributedSampler
 from .registry import SAMPLERS
@@ -30,4 +33,565 @@ class DistributSampler(DistributedSampler):
 
     def __init__(self, dataset, shuffle=True):
         rank, num_replicas = get_dist_info()
-        super().__init__(dataset, num_replicas, rank, shuffle)
\ No newline at end of file
+        super().__init__(dataset, num_replicas, rank, shuffle)
+
+
+@SAMPLERS.register_module()
+class ShardSampler(Sampler):
+    """Distributed sampler for evaluation: every sample is visited exactly once.
+
+    Rank ``r`` takes indices ``r, r + world_size, ...`` without the padding of
+    :class:`DistributSampler`, so no sample is counted twice in the reduced
+    metrics. Ranks may get one sample less, which is fine without gradient sync.
+    """
+
+    def __init__(self, dataset, shuffle=False):
+        self.dataset = dataset
+        self.rank, self.num_replicas = get_dist_info()
+
+    def __iter__(self):
+        return iter(range(self.rank, len(self.dataset), self.num_replicas))
+
+    def __len__(self):
+        return len(range(self.rank, len(self.dataset), self.num_replicas))
+
+@SAMPLERS.register_module()
+class AspectRatioBucketSampler(Sampler):
+    """Batch sampler that only batches samples of similar aspect ratio.
+
+    Samples are put into buckets by ``height / width`` (read from
+    ``dataset.image_shapes`` without decoding images), batches are drawn inside a
+    bucket and the batch order is shuffled. Used together with
+    ``Resize(keep_ratio=True)`` and :class:`PaddedCollate`, every batch is only
+    padded to the largest sample it contains instead of one global shape.
+
+    Args:
+        dataset (Dataset): Dataset with an ``image_shapes`` list of (height, width).
+        batch_size (int): Samples per batch.
+        aspect_ratios (list[float]): Bucket boundaries of ``height / width``.
+        max_size (tuple[int, int], optional): (height, width) of the keep-ratio
+            Resize, only used to report pixels per epoch.
+        size_divisor (int): Padding divisor of the collate, only used for the report.
+        shuffle (bool): Whether to shuffle samples and batches every epoch.
+        drop_last (bool): Whether to drop the incomplete batch of each bucket.
+        seed (int): Random seed, combined with the epoch set by ``set_epoch``.
+    """
+
+    def __init__(self, dataset, batch_size, aspect_ratios=(0.25, 0.5, 1., 2., 4.), max_size=None,
+                 size_divisor=32, shuffle=True, drop_last=False, seed=0):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.aspect_ratios = sorted(aspect_ratios)
+        self.max_size = max_size
+        self.size_divisor = size_divisor
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+        self.rank, self.num_replicas = get_dist_info()
+
+        shapes = np.array(dataset.image_shapes, dtype=np.float64).reshape(-1, 2)
+        self.bucket_ids = np.digitize(shapes[:, 0] / shapes[:, 1], self.aspect_ratios)
+        if max_size is not None:
+            ratio = np.minimum(max_size[0] / shapes[:, 0], max_size[1] / shapes[:, 1])
+            self.resized_shapes = np.maximum(np.round(shapes * ratio[:, None]), 1).astype(np.int64)
+        else:
+            self.resized_shapes = shapes.astype(np.int64)
+        self.num_batches = len(self._get_batches())
+        self.log_pixels()
+
+    def _get_batches(self):
+        g = torch.Generator()
+        g.manual_seed(self.seed + self.epoch)
+        batches = []
+        for bucket in np.unique(self.bucket_ids):
+            indices = np.nonzero(self.bucket_ids == bucket)[0]
+            if self.shuffle:
+                indices = indices[torch.randperm(len(indices), generator=g).numpy()]
+            for i in range(0, len(indices), self.batch_size):
+                batch = indices[i:i + self.batch_size].tolist()
+                if len(batch) < self.batch_size and self.drop_last:
+                    continue
+                batches.append(batch)
+        if self.shuffle:
+            batches = [batches[i] for i in torch.randperm(len(batches), generator=g).tolist()]
+        # 各 rank 的 batch 数保持一致
+        if self.num_replicas > 1 and len(batches) % self.num_replicas != 0:
+            batches += batches[:self.num_replicas - len(batches) % self.num_replicas]
+        return batches[self.rank::self.num_replicas]
+
+    def padded_pixels(self, batches):
+        pixels = 0
+        for batch in batches:
+            h, w = self.resized_shapes[batch].max(axis=0)
+            h = int(np.ceil(h / self.size_divisor) * self.size_divisor)
+            w = int(np.ceil(w / self.size_divisor) * self.size_divisor)
+            pixels += h * w * len(batch)
+        return pixels
+
+    def log_pixels(self, logger=None):
+        """对比固定尺寸与分桶 padding 后每个 epoch 处理的像素数."""
+        logger = logger or logging.getLogger()
+        batches = self._get_batches()
+        num_samples = sum(len(b) for b in batches)
+        fixed = num_samples * int(np.prod(self.max_size)) if self.max_size is not None \
+            else num_samples * int(self.resized_shapes.max(axis=0).prod())
+        bucketed = self.padded_pixels(batches)
+        counts = {int(b): int((self.bucket_ids == b).sum()) for b in np.unique(self.bucket_ids)}
+        logger.info(f"AspectRatioBucketSampler buckets {counts}, pixels per epoch: fixed shape {fixed / 1e6:.1f}M, "
+                    f"bucketed {bucketed / 1e6:.1f}M ({bucketed / max(fixed, 1) * 100:.1f}%)")
+        return fixed, bucketed
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __iter__(self):
+        return iter(self._get_batches())
+
+    def __len__(self):
+        return self.num_batches
+
+
+@SAMPLERS.register_module()
+class MultiScaleBatchSampler(Sampler):
+    """Batch sampler for multi-scale training with one resolution per batch.
+
+    Every batch draws a scale from ``scales`` and yields ``(index, (height, width))``
+    pairs; the dataset forwards the size to ``Resize`` as ``target_size``. The batch
+    size is scaled inversely with the pixel count, ``batch_size`` being the size at
+    ``scales[0]``, so the memory footprint stays roughly constant across scales.
+
+    Args:
+        dataset (Dataset): Dataset whose ``__getitem__`` accepts ``(index, size)``.
+        batch_size (int): Samples per batch at ``scales[0]``.
+        scales (list[tuple[int, int]]): Candidate (height, width) per batch.
+        shuffle (bool): Whether to shuffle samples every epoch.
+        drop_last (bool): Whether to drop the last incomplete batch.
+        seed (int): Random seed, combined with the epoch set by ``set_epoch``.
+    """
+
+    def __init__(self, dataset, batch_size, scales, shuffle=True, drop_last=False, seed=0):
+        self.dataset = dataset
+        self.scales = [tuple(s) for s in scales]
+        base_pixels = self.scales[0][0] * self.scales[0][1]
+        self.batch_sizes = [max(int(batch_size * base_pixels / (h * w)), 1) for h, w in self.scales]
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.seed = seed
+        self.rank, self.num_replicas = get_dist_info()
+        self.set_epoch(0)
+        logging.getLogger().info(
+            f"MultiScaleBatchSampler scales: {dict(zip(self.scales, self.batch_sizes))} (scale: batch size)")
+
+    def _get_batches(self):
+        g = torch.Generator()
+        g.manual_seed(self.seed + self.epoch)
+        n = len(self.dataset)
+        indices = torch.randperm(n, generator=g).tolist() if self.shuffle else list(range(n))
+        batches, start = [], 0
+        while start < n:
+            scale_idx = int(torch.randint(len(self.scales), (1,), generator=g))
+            batch_size = self.batch_sizes[scale_idx]
+            batch = indices[start:start + batch_size]
+            start += batch_size
+            if len(batch) < batch_size and self.drop_last:
+                break
+            batches.append([(i, self.scales[scale_idx]) for i in batch])
+        if self.num_replicas > 1 and len(batches) % self.num_replicas != 0:
+            batches += batches[:self.num_replicas - len(batches) % self.num_replicas]
+        return batches[self.rank::self.num_replicas]
+
+    def set_epoch(self, epoch):
+        # 每个 epoch 的 batch 数随抽到的尺度变化, 提前生成以便 __len__ 准确
+        self.epoch = epoch
+        self.batches = self._get_batches()
+
+    def __iter__(self):
+        return iter(self.batches)
+
+    def __len__(self):
+        return len(self.batches)
+
+
+@SAMPLERS.register_module()
+class BlockShuffleSampler(Sampler):
+    """Locality-preserving shuffle for packed, sharded or HDD-backed storage.
+
+    The index range is cut into contiguous blocks of ``block_size``, the block order
+    is permuted and then samples are shuffled inside windows of ``window_size``
+    consecutive positions. Reads within a window therefore touch only
+    ``window_size / block_size`` contiguous runs, turning random I/O into mostly
+    sequential reads while keeping most of the randomness of a full permutation.
+    With several ranks every rank gets a contiguous part of the epoch order.
+
+    Args:
+        dataset (Dataset): Dataset to sample from, indices follow its storage order.
+        block_size (int): Length of the contiguous index blocks. Defaults to 64.
+        window_size (int, optional): Length of the in-window shuffle. Defaults to
+            ``4 * block_size``.
+        shuffle (bool): Whether to shuffle at all. Defaults to True.
+        seed (int): Random seed, combined with the epoch set by ``set_epoch``.
+    """
+
+    def __init__(self, dataset, block_size=64, window_size=None, shuffle=True, seed=0):
+        self.dataset = dataset
+        self.block_size = max(block_size, 1)
+        self.window_size = max(window_size or 4 * self.block_size, 1)
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        self.rank, self.num_replicas = get_dist_info()
+        self.num_samples = int(np.ceil(len(dataset) / self.num_replicas))
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __iter__(self):
+        n = len(self.dataset)
+        indices = torch.arange(n)
+        if self.shuffle:
+            g = torch.Generator()
+            g.manual_seed(self.seed + self.epoch)
+            blocks = list(torch.split(indices, self.block_size))
+            indices = torch.cat([blocks[i] for i in torch.randperm(len(blocks), generator=g).tolist()])
+            windows = torch.split(indices, self.window_size)
+            indices = torch.cat([w[torch.randperm(len(w), generator=g)] for w in windows])
+        indices = indices.tolist()
+        total_size = self.num_samples * self.num_replicas
+        indices += indices[:total_size - n]
+        start = self.rank * self.num_samples
+        return iter(indices[start:start + self.num_samples])
+
+    def __len__(self):
+        return self.num_samples
+
+
+@SAMPLERS.register_module()
+class PixelBudgetBatchSampler(Sampler):
+    """Batch sampler that packs samples up to a pixel budget instead of a fixed count.
+
+    Samples are shuffled, sorted by size inside windows of ``sort_window`` samples
+    and packed greedily while the padded batch, ``B * max(H) * max(W)`` rounded up
+    to ``size_divisor``, stays within ``max_pixels``. Small images therefore form
+    large batches and large images small ones. Sizes come from
+    ``dataset.image_shapes``, optionally scaled like ``Resize(keep_ratio=True)``.
+
+    With several ranks the batches are grouped into rounds of ``num_replicas``
+    batches of neighbouring cost and every rank takes one batch of each round, so
+    all ranks see a similar pixel count per step.
+
+    Args:
+        dataset (Dataset): Dataset with an ``image_shapes`` list of (height, width).
+        batch_size (int): Upper bound on samples per batch.
+        max_pixels (int): Pixel budget of a padded batch.
+        max_size (tuple[int, int], optional): (height, width) of the keep-ratio Resize.
+        size_divisor (int): Padding divisor of the collate. Defaults to 32.
+        sort_window (int): Samples sorted together before packing. Defaults to 1024.
+        shuffle (bool): Whether to shuffle samples and batches every epoch.
+        drop_last (bool): Whether to drop the last batch if it is under half the budget.
+        seed (int): Random seed, combined with the epoch set by ``set_epoch``.
+    """
+
+    def __init__(self, dataset, batch_size, max_pixels, max_size=None, size_divisor=32, sort_window=1024,
+                 shuffle=True, drop_last=False, seed=0):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.max_pixels = max_pixels
+        self.size_divisor = size_divisor
+        self.sort_window = max(sort_window, 1)
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.seed = seed
+        self.rank, self.num_replicas = get_dist_info()
+
+        shapes = np.array(dataset.image_shapes, dtype=np.float64).reshape(-1, 2)
+        if max_size is not None:
+            ratio = np.minimum(max_size[0] / shapes[:, 0], max_size[1] / shapes[:, 1])
+            shapes = np.maximum(np.round(shapes * ratio[:, None]), 1)
+        self.shapes = (np.ceil(shapes / size_divisor) * size_divisor).astype(np.int64)
+        self.set_epoch(0)
+        logging.getLogger().info(
+            f"PixelBudgetBatchSampler: {self.num_total} batches per epoch, mean batch size "
+            f"{len(dataset) / max(self.num_total, 1):.1f}, budget {max_pixels / 1e6:.1f}M pixels")
+
+    def _cost(self, batch):
+        h, w = self.shapes[batch].max(axis=0)
+        return int(h * w * len(batch))
+
+    def _get_batches(self):
+        g = torch.Generator()
+        g.manual_seed(self.seed + self.epoch)
+        n = len(self.dataset)
+        indices = torch.randperm(n, generator=g).numpy() if self.shuffle else np.arange(n)
+        batches = []
+        for start in range(0, n, self.sort_window):
+            window = indices[start:start + self.sort_window]
+            window = window[np.argsort(self.shapes[window].prod(axis=1), kind='stable')]
+            batch = []
+            for i in window.tolist():
+                if batch and (len(batch) >= self.batch_size or self._cost(batch + [i]) > self.max_pixels):
+                    batches.append(batch)
+                    batch = []
+                batch.append(i)
+            if batch:
+                batches.append(batch)
+        if self.drop_last and batches and self._cost(batches[-1]) * 2 < self.max_pixels:
+            batches.pop()
+        self.num_total = len(batches)
+
+        # 按代价排序后每 num_replicas 个一组, 组内代价相近, 每个 rank 取组内一个
+        if self.num_replicas > 1:
+            if len(batches) % self.num_replicas != 0:
+                batches += batches[:self.num_replicas - len(batches) % self.num_replicas]
+            batches.sort(key=self._cost)
+        rounds = [batches[i:i + self.num_replicas] for i in range(0, len(batches), self.num_replicas)]
+        if self.shuffle:
+            rounds = [rounds[i] for i in torch.randperm(len(rounds), generator=g).tolist()]
+        return [r[self.rank] for r in rounds]
+
+    def set_epoch(self, epoch):
+        # batch 数随打乱结果变化, 提前生成以便 __len__ 准确
+        self.epoch = epoch
+        self.batches = self._get_batches()
+
+    def __iter__(self):
+        return iter(self.batches)
+
+    def __len__(self):
+        return len(self.batches)
+
+
+@SAMPLERS.register_module()
+class ImportanceSampler(Sampler):
+    """Sampler that draws the next epoch by the most recent loss of every sample.
+
+    ``TrainRunner`` reports the per-sample losses of each step with ``update``;
+    they are buffered on the device and written into the loss table when the
+    next epoch is drawn, so reporting never synchronizes the step. After
+    ``warmup_epochs`` uniform epochs, ``epoch_ratio * len(dataset)`` samples are
+    drawn with replacement with probability
+
+        p_i = uniform_ratio / N + (1 - uniform_ratio) * loss_i / sum(loss)
+
+    Samples without a recorded loss are scored with the largest recorded one.
+    The floor ``uniform_ratio`` keeps every sample reachable and bounds the
+    importance weight ``w_i = 1 / (N * p_i)`` by ``1 / uniform_ratio``; scaling
+    each sample's loss by ``w_i`` (see ``weights``) keeps the gradient an unbiased
+    estimate of the uniform one. With several ranks the losses are all-gathered
+    and every rank takes a disjoint part of the same draw.
+
+    Args:
+        dataset (Dataset): Dataset returning the sample ``index`` in every item.
+        shuffle (bool): Whether to shuffle the uniform epochs. Defaults to True.
+        uniform_ratio (float): Probability mass spread uniformly. Defaults to 0.3.
+        epoch_ratio (float): Samples per importance epoch relative to the dataset
+            size. Defaults to 1.
+        warmup_epochs (int): Uniform epochs before sampling by loss. Defaults to 1.
+        seed (int): Random seed, combined with the epoch set by ``set_epoch``.
+    """
+
+    def __init__(self, dataset, shuffle=True, uniform_ratio=0.3, epoch_ratio=1., warmup_epochs=1, seed=0):
+        assert 0 < uniform_ratio <= 1, f"uniform_ratio must be in (0, 1], but got {uniform_ratio}"
+        self.dataset = dataset
+        self.shuffle = shuffle
+        self.uniform_ratio = uniform_ratio
+        self.epoch_ratio = epoch_ratio
+        self.warmup_epochs = warmup_epochs
+        self.seed = seed
+        self.rank, self.num_replicas = get_dist_info()
+        self.losses = np.full(len(dataset), np.nan, dtype=np.float64)
+        self.epoch_losses = self.losses.copy()
+        self.probs = np.full(len(dataset), 1. / len(dataset), dtype=np.float64)
+        self.pending = []
+        self.set_epoch(0)
+
+    def update(self, index, losses):
+        """Record the losses of the samples ``index`` of one step, without synchronizing."""
+        self.pending.append((index, losses.detach()))
+
+    def state_dict(self):
+        # 只保存 epoch 开始时的损失表, 恢复后重新抽样得到同一个 epoch; 当前 epoch 新上报的损失不保存
+        return {'losses': self.epoch_losses.copy()}
+
+    def load_state_dict(self, state_dict):
+        self.losses = state_dict['losses'].copy()
+        self.epoch_losses = self.losses.copy()
+
+    def weights(self, index, device=None):
+        """Importance weights of the samples ``index`` in the current epoch."""
+        index = index.cpu().numpy() if isinstance(index, torch.Tensor) else np.asarray(index)
+        weights = 1. / (len(self.dataset) * self.probs[index])
+        return torch.as_tensor(weights, dtype=torch.float32, device=device)
+
+    def _gather(self, tensor):
+        size = torch.tensor([len(tensor)], device=tensor.device)
+        sizes = [torch.zeros_like(size) for _ in range(self.num_replicas)]
+        dist.all_gather(sizes, size)
+        max_size = int(max(sizes).item())
+        padded = torch.zeros(max_size, dtype=tensor.dtype, device=tensor.device)
+        padded[:len(tensor)] = tensor
+        gathered = [torch.zeros_like(padded) for _ in range(self.num_replicas)]
+        dist.all_gather(gathered, padded)
+        return torch.cat([g[:int(s.item())] for g, s in zip(gathered, sizes)])
+
+    def _flush(self):
+        if len(self.pending) > 0:
+            device = self.pending[0][1].device
+            index = torch.cat([torch.as_tensor(i).to(device).long().flatten() for i, _ in self.pending])
+            losses = torch.cat([l.float().flatten() for _, l in self.pending])
+        else:
+            device = torch.device('cpu')
+            index, losses = torch.zeros(0, dtype=torch.long), torch.zeros(0)
+        self.pending = []
+        if self.num_replicas > 1:
+            # 所有 rank 在 set_epoch 时一起调用, 保证各 rank 的损失表一致
+            if dist.get_backend() == 'nccl' and device.type == 'cpu':
+                index, losses = index.cuda(), losses.cuda()
+            index, losses = self._gather(index), self._gather(losses)
+        self.losses[index.cpu().numpy()] = losses.cpu().numpy()
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+        self._flush()
+        self.epoch_losses = self.losses.copy()
+        n = len(self.dataset)
+        g = torch.Generator()
+        g.manual_seed(self.seed + self.epoch)
+        seen = ~np.isnan(self.losses)
+        if epoch < self.warmup_epochs or not seen.any():
+            self.probs = np.full(n, 1. / n, dtype=np.float64)
+            indices = torch.randperm(n, generator=g).tolist() if self.shuffle else list(range(n))
+        else:
+            scores = np.where(seen, self.losses, self.losses[seen].max())
+            total = scores.sum()
+            self.probs = np.full(n, 1. / n) if total <= 0 else \
+                self.uniform_ratio / n + (1 - self.uniform_ratio) * scores / total
+            num_draws = max(int(round(n * self.epoch_ratio)), 1)
+            indices = torch.multinomial(torch.from_numpy(self.probs), num_draws, replacement=True,
+                                        generator=g).tolist()
+            logging.getLogger().info(
+                f"ImportanceSampler epoch {epoch}: {num_draws} draws, {len(set(indices))} unique samples, "
+                f"max weight {1. / (n * self.probs.min()):.2f}")
+        num_samples = int(np.ceil(len(indices) / self.num_replicas))
+        indices += indices[:num_samples * self.num_replicas - len(indices)]
+        self.indices = indices[self.rank * num_samples:(self.rank + 1) * num_samples]
+
+    def __iter__(self):
+        return iter(self.indices)
+
+    def __len__(self):
+        return len(self.indices)
+
+
+@SAMPLERS.register_module()
+class RepeatFactorSampler(Sampler):
+    """Class-balanced sampler that repeats images containing rare classes.
+
+    Following the repeat factor sampling of LVIS, with ``f_c`` the fraction of
+    images containing class ``c`` (read from ``dataset.image_label_sets``), every
+    class gets ``r_c = max(1, sqrt(repeat_thr / f_c))`` and every image the largest
+    ``r_c`` of its classes. Each epoch an image appears ``floor(r_i)`` times plus
+    once more with probability ``r_i - floor(r_i)``, so the expected count is
+    exactly ``r_i`` without duplicating files on disk. The stream is shuffled and
+    split into equal parts for the ranks.
+
+    Args:
+        dataset (Dataset): Dataset with an ``image_label_sets`` list of label names.
+        repeat_thr (float): Classes in fewer than this fraction of images are
+            repeated. Defaults to 0.1.
+        shuffle (bool): Whether to shuffle the epoch stream. Defaults to True.
+        seed (int): Random seed, combined with the epoch set by ``set_epoch``.
+    """
+
+    def __init__(self, dataset, repeat_thr=0.1, shuffle=True, seed=0):
+        self.dataset = dataset
+        self.repeat_thr = repeat_thr
+        self.shuffle = shuffle
+        self.seed = seed
+        self.rank, self.num_replicas = get_dist_info()
+
+        label_sets = dataset.image_label_sets
+        counts = dict()
+        for labels in label_sets:
+            for label in set(labels):
+                counts[label] = counts.get(label, 0) + 1
+        self.class_repeat = {c: max(1., np.sqrt(repeat_thr / (n / len(label_sets)))) for c, n in counts.items()}
+        self.repeat_factors = np.array(
+            [max([self.class_repeat[c] for c in labels] or [1.]) for labels in label_sets], dtype=np.float64)
+
+        logger = logging.getLogger()
+        logger.info(f"RepeatFactorSampler: {self.repeat_factors.sum():.0f} expected samples per epoch "
+                    f"for {len(label_sets)} images")
+        for c in sorted(counts):
+            expected = sum(r for r, labels in zip(self.repeat_factors, label_sets) if c in labels)
+            logger.info(f"  {c}: {counts[c]} images, repeat {self.class_repeat[c]:.2f}, {expected:.1f} per epoch")
+        self.set_epoch(0)
+
+    def set_epoch(self, epoch):
+        # 随机取整使每个 epoch 的样本数不同, 提前生成以便 __len__ 准确
+        self.epoch = epoch
+        g = torch.Generator()
+        g.manual_seed(self.seed + self.epoch)
+        rands = torch.rand(len(self.repeat_factors), generator=g, dtype=torch.float64).numpy()
+        repeats = np.floor(self.repeat_factors + rands).astype(np.int64)
+        indices = np.repeat(np.arange(len(self.repeat_factors)), repeats)
+        if self.shuffle:
+            indices = indices[torch.randperm(len(indices), generator=g).numpy()]
+        indices = indices.tolist()
+        num_samples = int(np.ceil(len(indices) / self.num_replicas))
+        indices += indices[:num_samples * self.num_replicas - len(indices)]
+        self.indices = indices[self.rank * num_samples:(self.rank + 1) * num_samples]
+
+    def __iter__(self):
+        return iter(self.indices)
+
+    def __len__(self):
+        return len(self.indices)
+
+
+class ResumableBatchSampler(Sampler):
+    """Wrap a batch sampler so that one epoch can start after its first batches.
+
+    Resuming in the middle of an epoch calls ``skip_batches(n)`` after
+    ``set_epoch``; the next iteration drops the first ``n`` batches of the epoch
+    before any index reaches the DataLoader workers, so no skipped sample is
+    loaded. The wrapped sampler must draw its order from ``(seed, epoch)`` only.
+    ``set_epoch``, ``state_dict`` and ``load_state_dict`` are forwarded to the
+    wrapped batch sampler and to its ``sampler``.
+    """
+
+    def __init__(self, batch_sampler):
+        self.batch_sampler = batch_sampler
+        self.skip = 0
+
+    @property
+    def sampler(self):
+        return getattr(self.batch_sampler, 'sampler', self.batch_sampler)
+
+    def _samplers(self):
+        return [self.batch_sampler] + ([self.sampler] if self.sampler is not self.batch_sampler else [])
+
+    def set_epoch(self, epoch):
+        for sampler in self._samplers():
+            if hasattr(sampler, 'set_epoch'):
+                sampler.set_epoch(epoch)
+
+    def state_dict(self):
+        return {type(s).__name__: s.state_dict() for s in self._samplers() if hasattr(s, 'state_dict')}
+
+    def load_state_dict(self, state_dict):
+        for sampler in self._samplers():
+            if type(sampler).__name__ in state_dict and hasattr(sampler, 'load_state_dict'):
+                sampler.load_state_dict(state_dict[type(sampler).__name__])
+
+    def skip_batches(self, num_batches):
+        self.skip = num_batches
+
+    def __iter__(self):
+        skip, self.skip = self.skip, 0
+        for i, batch in enumerate(self.batch_sampler):
+            if i >= skip:
+                yield batch
+
+    def __len__(self):
+        return max(len(self.batch_sampler) - self.skip, 0)
@@ -5,6 +5,8 @@ from ..registry import LOSSES
 
 @LOSSES.register_module()
 class DiceLoss(BaseLoss):
+    # Not a mean over pixels, element-wise ``weight`` is not applied.
+    pixel_weight = False
 
     def __init__(self,
                  smooth=1,
@@ -55,6 +57,9 @@ class DiceLoss(BaseLoss):
 
 @LOSSES.register_module()
 class NRDiceLoss(BaseLoss):
+    # Not a mean over pixels, element-wise ``weight`` is not applied.
+    pixel_weight = False
+
     def __init__(self,gamma=1.5, **kwargs):
         super(NRDiceLoss, self).__init__(loss_name='loss_nr_dice', **kwargs)
         self.gamma = gamma
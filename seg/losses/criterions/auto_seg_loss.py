@@ -37,6 +37,9 @@ def map_to_one_hot(x, num_class):
 
 @LOSSES.register_module()
 class AutoSegLoss(nn.Module):
+    # Not a mean over pixels, element-wise ``weight`` is not applied.
+    pixel_weight = False
+
     def __init__(self,
                  theta,
                  parameterization=None,
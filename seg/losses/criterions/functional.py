@@ -30,6 +30,20 @@ def cross_entropy(pred, label, weight=None, class_weight=None, reduction='mean',
     return  weight_reduce_loss(loss, weight=weight, reduction=reduction, avg_factor=avg_factor)
 
 
+def expand_binary_labels(label, pred_shape, weight=None):
+    """Labels of shape ``pred_shape`` for the binary losses, with the pixel weight
+    multiplied by the valid mask of the one-hot expansion instead of replaced by it."""
+    if pred_shape[1] != 1:
+        label, valid_mask = expand_onehot_labels(label, pred_shape)
+        valid_mask = valid_mask.unsqueeze(1).float()
+        weight = valid_mask if weight is None else valid_mask * weight.unsqueeze(1).float()
+        return label, weight.expand(pred_shape)
+    label = label.unsqueeze(dim=1)
+    if weight is not None and weight.dim() == label.dim() - 1:
+        weight = weight.unsqueeze(1)
+    return label, weight
+
+
 def binary_cross_entropy(pred,
                          label,
                          weight=None,
@@ -40,10 +54,7 @@ def binary_cross_entropy(pred,
                          ):
 
     if pred.dim() != label.dim():
-        if pred.shape[1] != 1:
-            label, weight = expand_onehot_labels(label, pred.shape)
-        else:
-            label = label.unsqueeze(dim=1)
+        label, weight = expand_binary_labels(label, pred.shape, weight)
 
     if weight is not None:
         weight = weight.float()
@@ -57,10 +68,7 @@ def binary_cross_entropy(pred,
 
 def focal_loss_with_logits(pred, label, alpha, gamma, weight=None, reduction='mean', avg_factor=None, ignore_index=-100, **kwargs):
     if pred.dim() != label.dim():
-        if pred.shape[1] != 1:
-            label, weight = expand_onehot_labels(label, pred.shape)
-        else:
-            label = label.unsqueeze(dim=1)
+        label, weight = expand_binary_labels(label, pred.shape, weight)
 
     pred = pred.sigmoid()
     logpt = F.binary_cross_entropy(pred, label.float(), reduction='none')
@@ -74,10 +82,7 @@ def focal_loss_with_logits(pred, label, alpha, gamma, weight=None, reduction='me
 
 def focal_loss_with_logits_V2(pred, label, alpha, gamma, weight=None, reduction='mean', avg_factor=None, ignore_index=-100, **kwargs):
     if pred.dim() != label.dim():
-        if pred.shape[1] != 1:
-            label, weight = expand_onehot_labels(label, pred.shape)
-        else:
-            label = label.unsqueeze(dim=1)
+        label, weight = expand_binary_labels(label, pred.shape, weight)
 
     logpt = F.binary_cross_entropy(pred, label.float(), reduction='none')
     pt = pred * label + (1 - pred) * (1 - label)
@@ -334,7 +339,10 @@ def boundary_loss(pred, target, theta0, theta, weight=None, reduction='mean', av
     BF1 = 2 * p * r / (p + r + 1e-7)
 
     loss = (1-BF1)
-    return  weight_reduce_loss(loss, weight=None, reduction=reduction, avg_factor=avg_factor)
+    if weight is not None:
+        # boundary F1 is computed per image, the pixel weight is averaged per image
+        weight = weight.reshape(n, -1).float().mean(dim=1, keepdim=True)
+    return  weight_reduce_loss(loss, weight=weight, reduction=reduction, avg_factor=avg_factor)
 
 
 # --------------------------------------------Distance Base----------------------------------------------------------
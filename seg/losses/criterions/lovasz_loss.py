@@ -227,6 +227,8 @@ class LovaszLoss(nn.Module):
             Default: None.
         loss_weight (float, optional): Weight of the loss. Defaults to 1.0.
     """
+    # Not a mean over pixels, element-wise ``weight`` is not applied.
+    pixel_weight = False
 
     def __init__(self,
                  loss_type='multi_class',
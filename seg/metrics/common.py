@@ -234,6 +234,51 @@ def parse_seg_metrics(all_metrics):
     return curr_metrics, best_index
 
 
+def accumulate_seg_metrics(all_metrics, num_thresholds):
+    """
+    把逐图像的指标累加成每类一行的求和量, 便于跨进程 all_reduce.
+    每行依次为 tp_fp_fn [3, T], prf1 [3, T], iou_auc_aupr [3] 的和以及图像数.
+    """
+    acc = np.zeros((len(all_metrics), 6 * num_thresholds + 4), dtype=np.float64)
+    for i, metrics in enumerate(all_metrics.values()):
+        for tp_fp_fn, prf1, iou_auc_aupr in metrics:
+            acc[i] += np.concatenate([np.ravel(tp_fp_fn), np.ravel(prf1), np.ravel(iou_auc_aupr), [1]])
+    return acc
+
+
+def parse_seg_accumulators(acc, num_thresholds):
+    """
+    与 parse_seg_metrics 相同的统计, 输入为 accumulate_seg_metrics 的(已归约的)累加量.
+    没有有效图像的类别该行指标为 0, 但不参与类别平均.
+    """
+    t = num_thresholds
+    valid = acc[:, -1] > 0
+    # 全部类别都没有图像时退化为对所有类别求平均 (结果为 0)
+    valid = valid if valid.any() else np.ones_like(valid)
+    count = np.maximum(acc[:, -1:], 1)
+    categories_sum_tp_fp_fn = acc[:, :3 * t].reshape(-1, 3, t)
+    categories_avg_prf1 = acc[:, 3 * t:6 * t].reshape(-1, 3, t) / count[:, :, None]
+    categories_avg_iou_aoc_aupr = acc[:, 6 * t:6 * t + 3] / count
+
+    avg_all_prf1 = categories_avg_prf1[valid].mean(axis=0, keepdims=True)
+    best_index = avg_all_prf1[..., -1, :].argmax()  # F1最佳阈值
+    curr_avg_all_prf1 = avg_all_prf1[..., best_index]
+
+    curr_best_categories_tp_fp_fn = categories_sum_tp_fp_fn[..., best_index]
+    curr_best_categories_prf1 = categories_avg_prf1[..., best_index]
+
+    curr_best_categories_metric = np.concatenate(
+        [curr_best_categories_tp_fp_fn, curr_best_categories_prf1, categories_avg_iou_aoc_aupr], axis=1)
+
+    curr_sum_all_tp_fp_fn = curr_best_categories_tp_fp_fn.sum(axis=0, keepdims=True)
+    curr_avg_all_iou_aoc_aupr = categories_avg_iou_aoc_aupr[valid].mean(axis=0, keepdims=True)
+
+    curr_avg_all_metric = np.concatenate([curr_sum_all_tp_fp_fn, curr_avg_all_prf1, curr_avg_all_iou_aoc_aupr], axis=1)
+
+    curr_metrics = np.concatenate([curr_best_categories_metric, curr_avg_all_metric], axis=0).round(4)
+    return curr_metrics, best_index
+
+
 def parse_seg_metrics_to_table(curr_metrics, best_metrics, label2class, logger):
     table = PrettyTable()
     table.field_names = ["", "TP", "FP", "FN", "Precision", "Recall", "F1", "iou", "AUC", "AUPR"]
@@ -1,8 +1,10 @@
 import copy
 import math
+import contextlib
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+import torch.utils.checkpoint as cp
 from seg.models.registry import *
 from seg.utils.checkpoint import get_state_dict
 from seg.models.utils import *
@@ -266,7 +268,7 @@ class MultiOrderGatedAggregation(nn.Module):
         return x
 
     def forward_gating(self, g, v):
-        with torch.autocast(device_type='cuda', enabled=False):
+        with torch.autocast(device_type=g.device.type, enabled=False):
             g = g.to(torch.float32)
             v = v.to(torch.float32)
             return self.proj_2(self.act_gate(g) * self.act_gate(v))
@@ -433,8 +435,46 @@ class StackConvPatchEmbed(nn.Module):
         return x, out_size
 
 
+@contextlib.contextmanager
+def frozen_bn_stats(module):
+    """BN layers of ``module`` normalize with the batch statistics but do not update
+    their running statistics and ``num_batches_tracked``."""
+    bns = [m for m in module.modules()
+           if isinstance(m, nn.modules.batchnorm._BatchNorm) and m.track_running_stats]
+    for m in bns:
+        m.track_running_stats = False
+    try:
+        yield
+    finally:
+        for m in bns:
+            m.track_running_stats = True
+
+
+def checkpoint_block(block, x):
+    """Run ``block`` with ``torch.utils.checkpoint``; the recomputation in backward
+    does not update the BN running statistics a second time."""
+    recompute = [False]
+
+    def run(x):
+        if recompute[0]:
+            with frozen_bn_stats(block):
+                return block(x)
+        recompute[0] = True
+        return block(x)
+
+    return cp.checkpoint(run, x, use_reentrant=False)
+
+
 @BLOCKS.register_module()
 class StageMogaBlock(nn.Module):
+    """Patch embedding, ``depth`` MogaBlocks and the stage norm.
+
+    With ``with_checkpoint`` the activations inside every MogaBlock are not kept
+    for backward but recomputed by ``torch.utils.checkpoint`` in training, only
+    the block inputs are stored. The recomputation normalizes with the same batch
+    statistics but does not update the BN running statistics, so training matches
+    the run without checkpointing.
+    """
 
     def __init__(self,
                  in_channels,
@@ -454,9 +494,11 @@ class StageMogaBlock(nn.Module):
                  attn_channel_split=[1, 3, 4],
                  attn_act_type='SiLU',
                  attn_force_fp32=False,
+                 with_checkpoint=False,
                  ):
         super().__init__()
         self.use_layer_norm = stem_norm_type == 'LN'
+        self.with_checkpoint = with_checkpoint
         patch_embed = StackConvPatchEmbed if patchembed_type == 'ConvEmbed' else ConvPatchEmbed
         self.patch_embed = patch_embed(in_channels, embed_dims, kernel_size, stride, act_type=act_type,
                                        norm_type=norm_type)
@@ -479,8 +521,12 @@ class StageMogaBlock(nn.Module):
 
     def forward(self, x):
         x, hw_shape = self.patch_embed(x)
+        use_checkpoint = self.with_checkpoint and self.training and torch.is_grad_enabled()
         for block in self.blocks:
-            x = block(x)
+            if use_checkpoint:
+                x = checkpoint_block(block, x)
+            else:
+                x = block(x)
         if self.use_layer_norm:
             x = x.flatten(2).transpose(1, 2)
             x = self.norm(x)
@@ -528,6 +574,9 @@ class MogaNet(nn.Module):
             should also keep it false during evaluation, because the output results
             of whether to use `attn_force_fp32` are different. We set it to false
             in this repo to facilitate code migration. Defaults to False.
+        with_checkpoint (bool | list[bool]): Whether to recompute the MogaBlock
+            activations of all stages, or of each stage, in backward to save
+            memory at the cost of one more forward of the blocks. Defaults to False.
         fork_feat (bool): Whether to output features of the 4 stages for dense
             prediction tasks in mmdetection and mmsegmentation. Defaults to False.
         frozen_stages (int): Stages to be frozen (stop grad and set eval mode).
@@ -581,6 +630,7 @@ class MogaNet(nn.Module):
                  attn_act_type='SiLU',
                  attn_final_dilation=True,
                  attn_force_fp32=False,
+                 with_checkpoint=False,
                  out_levels=[],
                  frozen_stages=-1,
                  init_cfg=None,
@@ -606,6 +656,11 @@ class MogaNet(nn.Module):
         self.attn_force_fp32 = attn_force_fp32
         self.use_layer_norm = stem_norm_type == 'LN'
         assert len(patchembed_types) == self.num_stages
+        if isinstance(with_checkpoint, bool):
+            with_checkpoint = [with_checkpoint] * self.num_stages
+        assert len(with_checkpoint) == self.num_stages, \
+            f'with_checkpoint needs {self.num_stages} values, but got {with_checkpoint}'
+        self.with_checkpoint = list(with_checkpoint)
         self.fork_feat = len(out_levels) > 1
         self.out_levels = out_levels
         self.frozen_stages = frozen_stages
@@ -637,7 +692,8 @@ class MogaNet(nn.Module):
                                    attn_dw_dilation=attn_dw_dilation,
                                    attn_channel_split=attn_channel_split,
                                    attn_act_type=attn_act_type,
-                                   attn_force_fp32=attn_force_fp32
+                                   attn_force_fp32=attn_force_fp32,
+                                   with_checkpoint=self.with_checkpoint[i],
                                    )
             cur_block_idx += depth
             self.add_module(f'stage{i + 1}', stage)
@@ -7,6 +7,51 @@ from seg.models.utils.weight_init import normal_init
 from seg.losses import build_loss
 
 
+def sample_losses(seg_logit, seg_label, ignore_label=None):
+    """Per-sample pixel-mean cross entropy, used to rank samples by difficulty.
+
+    Computed without gradient and independently of the configured losses, so it
+    also works for region losses (Dice, IoU, Lovasz) that only exist per batch.
+
+    Returns
+    -------
+    Tensor
+        Loss of every sample, shape [B].
+    """
+    with torch.no_grad():
+        seg_logit = seg_logit.float()
+        if seg_logit.shape[1] == 1:
+            loss = F.binary_cross_entropy_with_logits(
+                seg_logit[:, 0], (seg_label > 0).float(), reduction='none')
+            if ignore_label is not None:
+                loss = loss * (seg_label != ignore_label)
+        else:
+            loss = F.cross_entropy(seg_logit, seg_label.long(), reduction='none',
+                                   ignore_index=-100 if ignore_label is None else ignore_label)
+        return loss.flatten(1).mean(dim=1)
+
+
+def weighted_loss(loss_decode, seg_logit, seg_label, weight=None, sample_weight=None, ignore_label=None):
+    """Evaluate one loss term with an optional per-sample weight.
+
+    ``sample_weight`` [B] (e.g. the importance weights of ``ImportanceSampler``)
+    is multiplied into the pixel ``weight``. Losses that ignore ``weight``
+    (``pixel_weight = False``, e.g. Lovasz) are evaluated image by image
+    instead, and the image losses are scaled by ``sample_weight`` and averaged.
+    """
+    if sample_weight is None:
+        return loss_decode(seg_logit, seg_label, weight=weight, ignore_label=ignore_label)
+    sample_weight = sample_weight.to(device=seg_logit.device, dtype=seg_logit.dtype)
+    if getattr(loss_decode, 'pixel_weight', True):
+        image_weight = sample_weight.view(-1, *([1] * (seg_label.dim() - 1))).expand_as(seg_label)
+        weight = image_weight if weight is None else weight * image_weight
+        return loss_decode(seg_logit, seg_label, weight=weight, ignore_label=ignore_label)
+    loss = [loss_decode(seg_logit[i:i + 1], seg_label[i:i + 1],
+                        weight=None if weight is None else weight[i:i + 1], ignore_label=ignore_label)
+            for i in range(seg_logit.shape[0])]
+    return (torch.stack(loss) * sample_weight).mean()
+
+
 class BaseHead(nn.Module, metaclass=ABCMeta):
     """Base class for BaseDecodeHead.
 
@@ -184,7 +229,8 @@ class BaseHead(nn.Module, metaclass=ABCMeta):
         """Placeholder of forward function."""
         pass
 
-    def forward_train(self, inputs, gt_semantic_seg, **kwargs):
+    def forward_train(self, inputs, gt_semantic_seg, weight=None, return_sample_losses=False,
+                      sample_weight=None, **kwargs):
         """Forward function for training.
 
         Parameters
@@ -194,6 +240,12 @@ class BaseHead(nn.Module, metaclass=ABCMeta):
         gt_semantic_seg : Tensor
             Semantic segmentation masks
             used if the architecture supports semantic segmentation task.
+        weight : Tensor, optional
+            Pixel weight for calculate loss.
+        return_sample_losses : bool
+            Whether to add the detached per-sample losses as ``sample_losses``.
+        sample_weight : Tensor, optional
+            Per-sample loss weight [B], applied to every loss term (see ``weighted_loss``).
 
         Returns
         -------
@@ -201,7 +253,7 @@ class BaseHead(nn.Module, metaclass=ABCMeta):
             a dictionary of loss components
         """
         seg_logits = self.forward(inputs)
-        losses = self.losses(seg_logits, gt_semantic_seg)
+        losses = self.losses(seg_logits, gt_semantic_seg, weight, return_sample_losses, sample_weight)
         return losses
 
     def forward_infer(self, inputs, **kwargs):
@@ -226,7 +278,7 @@ class BaseHead(nn.Module, metaclass=ABCMeta):
         output = self.conv_seg(feat)
         return output
 
-    def losses(self, seg_logit, seg_label):
+    def losses(self, seg_logit, seg_label, weight=None, return_sample_losses=False, sample_weight=None):
         """Compute segmentation loss."""
         loss = dict()
         seg_logit = F.interpolate(
@@ -237,20 +289,27 @@ class BaseHead(nn.Module, metaclass=ABCMeta):
         if self.sampler is not None:
             seg_weight = self.sampler.sample(seg_logit, seg_label)
         else:
-            seg_weight = None
+            seg_weight = weight
         seg_label = seg_label.squeeze(1)
+        if return_sample_losses:
+            loss['sample_losses'] = sample_losses(seg_logit, seg_label, self.ignore_label)
 
         if not isinstance(self.loss_decode, nn.ModuleList):
             losses_decode = [self.loss_decode]
         else:
             losses_decode = self.loss_decode
 
-        for loss_decode in losses_decode:
-            loss[loss_decode.loss_name] = loss_decode(
-                seg_logit,
-                seg_label,
-                weight=seg_weight,
-                ignore_label=self.ignore_label)
+        # 混合精度训练时损失仍在 fp32 下计算
+        with torch.autocast(device_type=seg_logit.device.type, enabled=False):
+            seg_logit = seg_logit.float()
+            for loss_decode in losses_decode:
+                loss[loss_decode.loss_name] = weighted_loss(
+                    loss_decode,
+                    seg_logit,
+                    seg_label,
+                    weight=seg_weight,
+                    sample_weight=sample_weight,
+                    ignore_label=self.ignore_label)
         # loss['loss_seg'] = self.loss(
         #     seg_logit,
         #     seg_label,
@@ -6,6 +6,7 @@ import numpy as np
 from seg.models.registry import *
 from seg.losses import build_loss
 from seg.models._base_._bricks_ import *
+from .base_head import sample_losses, weighted_loss
 
 def fill_up_weights(up):
     w = up.weight.data
@@ -228,7 +229,7 @@ class DLAHead(nn.Module):
                 m.weight.data.fill_(1)
                 m.bias.data.zero_()
 
-    def losses(self, seg_logit, seg_label, weight=None):
+    def losses(self, seg_logit, seg_label, weight=None, return_sample_losses=False, sample_weight=None):
         """Compute segmentation loss."""
         if self.sampler is not None:
             seg_weight = self.sampler.sample(seg_logit, seg_label)
@@ -242,21 +243,29 @@ class DLAHead(nn.Module):
                            size=input_size,
                            mode='bilinear',
                            align_corners=self.align_corners)
+        if return_sample_losses:
+            loss['sample_losses'] = sample_losses(seg_logit, seg_label, self.ignore_label)
 
         if not isinstance(self.loss_decode, nn.ModuleList):
             losses_decode = [self.loss_decode]
         else:
             losses_decode = self.loss_decode
 
-        for loss_decode in losses_decode:
-            loss[loss_decode.loss_name] = loss_decode(
-                 seg_logit,
-                 seg_label,
-                 weight=seg_weight,
-                 ignore_label=self.ignore_label)
+        # 混合精度训练时损失仍在 fp32 下计算
+        with torch.autocast(device_type=seg_logit.device.type, enabled=False):
+            seg_logit = seg_logit.float()
+            for loss_decode in losses_decode:
+                loss[loss_decode.loss_name] = weighted_loss(
+                     loss_decode,
+                     seg_logit,
+                     seg_label,
+                     weight=seg_weight,
+                     sample_weight=sample_weight,
+                     ignore_label=self.ignore_label)
         return loss
 
-    def forward_train(self, inputs, gt_semantic_seg, weight=None, **kwargs):
+    def forward_train(self, inputs, gt_semantic_seg, weight=None, return_sample_losses=False,
+                      sample_weight=None, **kwargs):
         """Forward function for training.
 
         Parameters
@@ -268,6 +277,10 @@ class DLAHead(nn.Module):
             used if the architecture supports semantic segmentation task.
         weight: Tensor
             image weight for calculate loss.
+        return_sample_losses : bool
+            Whether to add the detached per-sample losses as ``sample_losses``.
+        sample_weight : Tensor, optional
+            Per-sample loss weight [B], applied to every loss term (see ``weighted_loss``).
         Returns
         -------
         dict[str, Tensor]
@@ -278,7 +291,7 @@ class DLAHead(nn.Module):
             seg_logits, feat = self.forward(inputs, **kwargs)
         else:
             seg_logits = self.forward(inputs, **kwargs)
-        losses = self.losses(seg_logits, gt_semantic_seg, weight)
+        losses = self.losses(seg_logits, gt_semantic_seg, weight, return_sample_losses, sample_weight)
         return losses if feat is None else (losses, feat)
 
     def forward_infer(self, inputs, **kwargs):
@@ -3,7 +3,6 @@ import torch.nn as nn
 import logging
 from abc import ABCMeta, abstractmethod
 from collections import OrderedDict
-from seg.utils.distribute import reduce_value
 
 
 class BaseSegmentor(nn.Module):
@@ -94,7 +93,10 @@ class BaseSegmentor(nn.Module):
         """
         parsed_metrics = OrderedDict()
 
-        metrics = {key: reduce_value(loss, average=True) for key, loss in metrics.items() if "loss" in key}
+        # 逐样本损失只用于采样, 不参与总损失
+        sample_losses = [metrics.pop(key) for key in list(metrics) if key.endswith('sample_losses')]
+        # 只使用本卡的损失, 不做同步; 梯度由 DDP 归约, 日志中的损失由 TrainRunner 在日志步打包归约
+        metrics = {key: loss for key, loss in metrics.items() if "loss" in key}
         for metric_name, metric_value in metrics.items():
             if "loss" in metric_name:
                 if isinstance(metric_value, torch.Tensor):
@@ -114,5 +116,7 @@ class BaseSegmentor(nn.Module):
                    if 'loss' in _key)
 
         parsed_metrics['loss'] = loss
+        if len(sample_losses) > 0:
+            parsed_metrics['sample_losses'] = sum(sample_losses)
 
         return parsed_metrics
@@ -125,7 +125,8 @@ class EncoderDecoder(BaseSegmentor):
 
         return losses
 
-    def forward_train(self, inputs, ground_truth, return_feat=False, **kwargs):
+    def forward_train(self, inputs, ground_truth, return_feat=False, sample_weight=None,
+                      return_sample_losses=False, **kwargs):
         """Forward function for training.
 
         Parameters
@@ -135,6 +136,12 @@ class EncoderDecoder(BaseSegmentor):
         ground_truth : Tensor
             Semantic segmentation masks
             used if the architecture supports semantic segmentation task.
+        sample_weight : Tensor, optional
+            Per-sample loss weight [B], e.g. the importance weights of
+            :class:`ImportanceSampler`. Every loss term of the decode and
+            auxiliary heads is scaled per sample (see ``weighted_loss``).
+        return_sample_losses : bool
+            Whether the decode head also returns the detached per-sample losses.
 
         Returns
         -------
@@ -148,12 +155,13 @@ class EncoderDecoder(BaseSegmentor):
         gt_masks = ground_truth
         # gt_masks = ground_truth['mask'].to(inputs.device, dtype=inputs.dtype)
         # weight = ground_truth['weight'].to(inputs.device, dtype=inputs.dtype) if "weight" in ground_truth else None
-        loss_decode = self._decode_head_forward_train(feat, gt_masks, weight=None, **kwargs)
+        loss_decode = self._decode_head_forward_train(feat, gt_masks, sample_weight=sample_weight,
+                                                      return_sample_losses=return_sample_losses, **kwargs)
         losses.update(loss_decode)
 
         if self.with_auxiliary_head:
             loss_aux = self._auxiliary_head_forward_train(
-                feat, gt_masks, **kwargs)
+                feat, gt_masks, sample_weight=sample_weight, **kwargs)
             losses.update(loss_aux)
 
         return (losses, feat) if return_feat else losses
@@ -0,0 +1,176 @@
+import logging
+import queue
+import traceback
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+
+from seg.metrics.common import calculate_metric_for_more, calculate_metric_for_one, accumulate_seg_metrics
+
+
+def valid_loop(model, dataloader, label2class, class2label, is_valid=True, preprocess=None, logger=None):
+    """在 dataloader 上评估模型.
+
+    参数: is_valid (bool): False 表示 TRT 模型, 输出为 tuple.
+         preprocess (callable, optional): 输入模型前对图像的处理, 例如转为 channels_last.
+    返回: tuple[ndarray, ndarray]: 指标累加量 (见 accumulate_seg_metrics) 和阈值列表.
+    """
+    all_seg_metrics_dict = dict()
+    for i in range(len(label2class)):
+        all_seg_metrics_dict[label2class[i]] = []
+
+    valid_iters = len(dataloader)
+    interval = max(valid_iters // 10, 1)
+    # 与 confuse_matrix_for_segmentation 的默认阈值一致, 本 rank 没有可评估的图像时使用
+    threshold_list = np.arange(0.05, 1.0, 0.05)
+    with torch.no_grad():
+        for idx, batch_data in enumerate(dataloader):
+            image = batch_data['image']
+            y_trues = batch_data['mask'].numpy().astype(np.uint8)
+            if is_valid:
+                image = preprocess(image) if preprocess is not None else image
+                probs = model(image).cpu().numpy()
+            else:
+                probs = model(image)[0].cpu().numpy()
+            if len(class2label) > 1:
+                # 多分类评估
+                y_probs = np.transpose(probs, (0, 2, 3, 1))  # [B C H W] -> [B H W C]
+                y_preds = np.argmax(y_probs, axis=-1).astype(np.uint8)
+                for class_idx in range(len(class2label)):
+                    metrics = []
+                    for y_pred, y_prob, y_true in zip(y_preds, y_probs, y_trues):
+                        mask = (y_true == class_idx).astype(np.uint8)
+                        if mask.sum() == 0:
+                            # GT 不存在， 计算召回是都为0，因此不参与计算
+                            continue
+                        prob = y_prob[..., class_idx]
+                        pred = (y_pred == class_idx).astype(np.uint8)
+                        metric, threshold_list = calculate_metric_for_more(prob, pred, mask)
+                        metrics.append(metric)
+                    all_seg_metrics_dict[label2class[class_idx]] += metrics
+            else:
+                if 'background' not in all_seg_metrics_dict:
+                    all_seg_metrics_dict['background'] = []
+
+                y_probs = probs
+                for y_prob, y_true in zip(y_probs, y_trues):
+                    metric, threshold_list = calculate_metric_for_one(y_prob, y_true)
+                    metrics.append(metric)
+                    all_seg_metrics_dict["foreground"] += [metric]
+            if logger is not None and idx % interval == 0 and idx // interval > 0:
+                logger.info(f"Step:{idx}/{valid_iters}")
+    return accumulate_seg_metrics(all_seg_metrics_dict, len(threshold_list)), threshold_list
+
+
+def _valid_worker(cfg, tasks, results):
+    """验证进程: 构建自己的模型和验证集 DataLoader, 逐个评估收到的权重快照."""
+    # spawn 出的进程重新导入, 避免在主进程导入时产生循环依赖
+    from seg.models.registry import build_segmentation
+    from seg.datasets import build_dataset
+    from seg.dataloaders import build_dataloader
+    from seg.transforms.compose import Compose
+
+    logger = logging.getLogger()
+    if cfg['num_threads'] is not None:
+        torch.set_num_threads(cfg['num_threads'])
+    device = torch.device(cfg['device'])
+    if device.type == 'cuda':
+        torch.cuda.set_device(device)
+    model_cfg = dict(cfg['model'], pretrained=None)
+    model = build_segmentation(model_cfg).to(device)
+    if cfg['channels_last']:
+        model.to(memory_format=torch.channels_last)
+    model.eval()
+    valid_cfg = cfg['valid']
+    dataset = build_dataset(valid_cfg['dataset'], dict(transform=Compose(valid_cfg['transform']), logger=logger))
+    # 验证进程是单个进程, 按一个设备构建 DataLoader
+    dataloader = build_dataloader(dict(valid_cfg['dataloader']), 1, False,
+                                  dict(dataset=dataset, shuffle=False))
+
+    def preprocess(image):
+        image = image.to(device)
+        return image.contiguous(memory_format=torch.channels_last) if cfg['channels_last'] else image
+
+    parent = mp.parent_process()
+    while True:
+        try:
+            task = tasks.get(timeout=5)
+        except queue.Empty:
+            if parent is not None and not parent.is_alive():
+                return
+            continue
+        if task is None:
+            return
+        epoch, state_dict = task
+        try:
+            model.load_state_dict(state_dict)
+            metric_acc, threshold_list = valid_loop(model, dataloader, dataset.label2class, dataset.class2label,
+                                                    preprocess=preprocess)
+            results.put((epoch, metric_acc, threshold_list, None))
+        except Exception:
+            results.put((epoch, None, None, traceback.format_exc()))
+
+
+class AsyncValidator:
+    """Validate weight snapshots in a separate process while training goes on.
+
+    The worker is started with the ``spawn`` method and builds its own model,
+    dataset and DataLoader from the configs, so the forward pass and the
+    CPU-heavy metric computation never block the training loop. ``submit``
+    sends a cpu ``state_dict`` snapshot through a ``torch.multiprocessing``
+    queue; the results are returned in submission order by ``poll``. The worker
+    evaluates the whole valid split and exits when its parent is gone. ``submit``
+    and ``poll`` raise ``RuntimeError`` once the worker has died.
+
+    Args:
+        model_cfg (dict): Config of the segmentation model.
+        valid_cfg (dict): ``data.valid`` config with dataset, transform and dataloader.
+        device (str): Device of the worker. Defaults to 'cpu'.
+        channels_last (bool): Run the model in channels_last. Defaults to False.
+        num_threads (int, optional): Torch intra-op threads of the worker.
+    """
+
+    def __init__(self, model_cfg, valid_cfg, device='cpu', channels_last=False, num_threads=None):
+        ctx = mp.get_context('spawn')
+        self.tasks, self.results = ctx.Queue(), ctx.Queue()
+        cfg = dict(model=model_cfg, valid=valid_cfg, device=str(device), channels_last=channels_last,
+                   num_threads=num_threads)
+        # 非 daemon 进程, 验证集 DataLoader 可以启动自己的 worker
+        self.process = ctx.Process(target=_valid_worker, args=(cfg, self.tasks, self.results),
+                                   name='AsyncValidator')
+        self.process.start()
+        self.num_pending = 0
+
+    def _check_alive(self):
+        if not self.process.is_alive():
+            raise RuntimeError(f'Async validation worker exited with code {self.process.exitcode}, '
+                               f'{self.num_pending} submitted snapshots were not validated.')
+
+    def submit(self, epoch, state_dict):
+        self._check_alive()
+        self.tasks.put((epoch, state_dict))
+        self.num_pending += 1
+
+    def poll(self, block=False):
+        """Returns the finished ``(epoch, metric_acc, threshold_list, error)``, with ``block`` all pending ones."""
+        finished = []
+        while self.num_pending > 0:
+            try:
+                finished.append(self.results.get(timeout=5) if block else self.results.get_nowait())
+            except queue.Empty:
+                self._check_alive()
+                if block:
+                    continue
+                break
+            self.num_pending -= 1
+        return finished
+
+    def close(self, wait=True):
+        """With ``wait`` the queued snapshots are still validated, otherwise the worker is terminated."""
+        if not self.process.is_alive():
+            return
+        if wait:
+            self.tasks.put(None)
+        else:
+            self.process.terminate()
+        self.process.join()
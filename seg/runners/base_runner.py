@@ -6,13 +6,27 @@ from torch.backends import cudnn
 import random
 import numpy as np
 
-from seg.utils.distribute import init_dist_pytorch, get_dist_info, cuda_is_available, devices_count
+from seg.utils.distribute import init_dist_pytorch, get_dist_info, cuda_is_available, devices_count, \
+    get_local_rank, broadcast_object
 from seg.loggers import build_logger
 
 
 class BaseRunner(object):
     def __init__(self, cfg):
-        self.timestamp = time.strftime('%Y%m%d_%H%M%S', time.localtime())
+        self.distribute = cfg.get('distribute', False)
+        self.gpu_num = devices_count()
+        self.ues_gpu = cuda_is_available()
+
+        if self.distribute:
+            init_dist_pytorch(**cfg.get('dist_params', {}))
+        self.rank, self.world_size = get_dist_info()
+        if self.ues_gpu:
+            self.device = torch.device('cuda', get_local_rank() % self.gpu_num if self.distribute else 0)
+        else:
+            self.device = torch.device('cpu')
+
+        # 所有 rank 使用 rank 0 的时间戳, 保证写入同一个 workdir
+        self.timestamp = broadcast_object(time.strftime('%Y%m%d_%H%M%S', time.localtime()))
         self.workdir = opj(cfg.get('workdir', 'workdir'), self.timestamp)
         os.makedirs(self.workdir, exist_ok=True)
         logger_cfg = cfg.get('logger')
@@ -23,15 +37,14 @@ class BaseRunner(object):
                     dict(type='FileHandler', level='INFO'),
                 )
             )
+        if self.rank != 0:
+            # 只有 rank 0 写日志文件, 其他 rank 只输出警告和错误
+            logger_cfg = dict(handlers=(dict(type='StreamHandler', level='WARNING'),))
         self.logger = self._build_logger(logger_cfg)
         self.logger.info(f'workdir: {self.workdir}')
-        self.distribute = cfg.get('distribute', False)
-
-        self.gpu_num = devices_count()
-        self.ues_gpu = cuda_is_available()
-
-        if self.distribute and self.ues_gpu:
-            init_dist_pytorch(**cfg['dist_params'])
+        if self.distribute:
+            self.logger.info(f'Distributed training with {self.world_size} processes, '
+                             f'backend: {torch.distributed.get_backend()}, device: {self.device}')
 
         self._set_cudnn(
             cfg.get('cudnn_deterministic', True),
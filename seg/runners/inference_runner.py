@@ -14,6 +14,10 @@ class InferenceRunner(BaseRunner):
 
         self.transform = self._build_transform(inference_cfg['transform'])
 
+        # channels_last: 模型参数和输入使用 NHWC 布局; compile: bool 或 torch.compile 的参数
+        self.channels_last = inference_cfg.get('channels_last', False)
+        self.compile_cfg = inference_cfg.get('compile', None)
+
         self._build_model(inference_cfg['model'])
 
         self.model.eval()
@@ -21,31 +25,39 @@ class InferenceRunner(BaseRunner):
     def _build_model(self, cfg):
         self.logger.info(f"Building model.")
         self.model = build_segmentation(cfg)
-        # if cuda_is_available():
-        #     if self.distribute:
-        #         self.model = torch.nn.parallel.DistributedDataParallel(
-        #             self.model.cuda(),
-        #             device_ids=[1],
-        #             broadcast_buffers=True,
-        #         )
-        #         self.logger.info('Using DistributedDataParallel Training.')
-        #     else:
-        #         if devices_count() > 1:
-        #             self.model = torch.nn.DataParallel(self.model)
-        #             self.logger.info('Using DataParallel Training.')
-        self.model.cuda()
+        self.model.to(self.device)
+        self._set_execution_mode()
         self.logger.info(f"Building model Done.")
 
-    def _build_transform(self, cfg):
-        return Compose(cfg)
+    def _set_execution_mode(self):
+        if self.channels_last:
+            self.model.to(memory_format=torch.channels_last)
+        if self.compile_cfg:
+            kwargs = self.compile_cfg if isinstance(self.compile_cfg, dict) else {}
+            # 只替换实例的 forward, 模块本身不变, state_dict 的 key, DDP 包装和 checkpoint 都与 eager 模式一致
+            self.model.forward = torch.compile(self.model.forward, **kwargs)
+        self.logger.info(f"Execution mode: channels_last {self.channels_last}, compile {self.compile_cfg}")
+
+    @staticmethod
+    def _eager_model(model):
+        """去掉 torch.compile 编译的 forward, 导出 onnx 需要 eager 模式."""
+        model.__dict__.pop('forward', None)
+        return model
+
+    def _to_memory_format(self, image):
+        if self.channels_last and image.dim() == 4:
+            return image.contiguous(memory_format=torch.channels_last)
+        return image
+
+    def _build_transform(self, cfg, cache=None, timing=False):
+        return Compose(cfg, cache=cache, timing=timing)
 
     def __call__(self, image, mask):
         with torch.no_grad():
             data = {'image': image, 'mask': mask}
             image = self.transform(**data)['image']
             image = image.unsqueeze(0)
-            if self.ues_gpu:
-                image = image.cuda()
+            image = self._to_memory_format(image.to(self.device))
 
             output = self.model(image)
             # output = self.compute(output)
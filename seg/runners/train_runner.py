@@ -1,23 +1,30 @@
 import os
 import time
+import signal
 import traceback
+import contextlib
 from os.path import join as opj
 import torch
 
 from .inference_runner import InferenceRunner
+from .async_valid import AsyncValidator, valid_loop
 
-from seg.dataloaders import build_dataloader
+from seg.dataloaders import build_dataloader, DevicePrefetcher
 from seg.datasets import build_dataset
+from seg.datasets.samplers import ImportanceSampler
 from seg.optimizers import build_optimizer
 from seg.lr_schedulers import build_lr_scheduler
 from collections.abc import Iterable
 import numpy as np
-from seg.utils import get_gpu_memroy, save_json, save_checkpoint, load_checkpoint
+from seg.utils import get_peak_memory, save_json, load_checkpoint, reduce_value, reduce_scalars, reduce_flag, \
+    is_dist_avail_and_initialized, CheckpointWriter, get_rng_state, set_rng_state, ModelEMA, snapshot_to_cpu
+from seg.models.registry import NORMS
 import datetime
-from seg.metrics.common import calculate_metric_for_more, calculate_metric_for_one, parse_seg_metrics, \
-    parse_seg_metrics_to_table
+from seg.metrics.common import parse_seg_metrics_to_table, parse_seg_accumulators
 from seg.export.converters import TRTModel, torch2onnx
-from seg.statistics.statistics import ClsStatistics
+from seg.statistics.statistics import ClsStatistics, ScaleThroughput
+from seg.statistics.telemetry import StepTelemetry
+from seg.transforms.compose import BatchCompose, TimingStatistics, TIMING_KEY
 
 
 class TrainRunner(InferenceRunner):
@@ -37,42 +44,171 @@ class TrainRunner(InferenceRunner):
             self.train_cfg['train']['transform'][-2].update(mean_std)
             self.train_cfg['valid']['transform'][-2].update(mean_std)
 
-        cfg = {'common': self.base_cfg, 'inference': self.inference_cfg, 'data': self.train_cfg,
-               'export': self.export_cfg}
-        jp = opj(self.workdir, self.timestamp + '.json')
-        save_json(cfg, jp)
+        # 训练集的采样顺序只由 (seed, epoch) 决定, 断点续训时可以从 epoch 中间继续
+        self.train_dataloader = self._build_dataloader(self.train_cfg['train'], resumable=True)
+
+        self.scale_throughput = ScaleThroughput()
+        self.batch_transform = self._build_batch_transform(self.train_cfg['train'].get('batch_transform'))
+        # 主进程中的 batch 增强在拷贝到设备之前执行, 设备上的增强在 _train 中执行
+        host_transform = self.batch_transform \
+            if self.batch_transform is not None and not self.batch_transform.on_device else None
+        self.train_dataloader = DevicePrefetcher(self.train_dataloader, self.device, transform=host_transform)
+        self.transform_timing = TimingStatistics(self.train_dataloader.dataset.transform.names) \
+            if self.train_cfg['train'].get('timing', False) else None
 
-        self.train_dataloader = self._build_dataloader(self.train_cfg['train'])
+        sampler = self.train_dataloader.batch_sampler.sampler
+        self.importance_sampler = sampler if isinstance(sampler, ImportanceSampler) else None
 
-        self.valid_dataloader = self._build_dataloader(self.train_cfg['valid'])
+        # 验证集按 rank 切分且不补齐, 指标累加量在 _valid 中归约
+        self.valid_dataloader = DevicePrefetcher(
+            self._build_dataloader(self.train_cfg['valid'], dict(type='ShardSampler')), self.device, keys=('image',))
         self.shape_labels = self.valid_dataloader.dataset.shape_labels
         self.class2label = self.valid_dataloader.dataset.class2label
         self.label2class = self.valid_dataloader.dataset.label2class
 
+        # 在构建 DataLoader 之后保存, 记录自动调优选出的 workers_per_gpu/prefetch_factor
+        cfg = {'common': self.base_cfg, 'inference': self.inference_cfg, 'data': self.train_cfg,
+               'export': self.export_cfg}
+        jp = opj(self.workdir, self.timestamp + '.json')
+        if self.rank == 0:
+            save_json(cfg, jp)
+
+        self._wrap_model()
+        self.ema, self.ema_eval = self._build_ema(self.train_cfg.get('ema'))
         self.optimizer = self._build_optimizer(self.train_cfg['optimizer'])
         self.lr_scheduler = self._build_lr_scheduler(self.train_cfg['lr_scheduler'])
         self.max_epochs = self.train_cfg['max_epochs']
-        self.iters = len(self.train_dataloader)
-        self.log_interval = self.train_cfg.get('log_interval', self.iters // 10)
+        self.amp_dtype, self.grad_scaler = self._build_amp(self.train_cfg.get('amp'))
+        # 梯度累积: 每 accumulate_steps 个 micro-batch 更新一次参数, iters 与 log_interval 按参数更新次数计
+        self.accumulate_steps = max(self.train_cfg.get('accumulate_steps', 1), 1)
+        self.iters = self._optimizer_steps(len(self.train_dataloader))
+        self.global_step = 0
+        self.log_interval = max(self.train_cfg.get('log_interval', self.iters // 10), 1)
+        # 每个日志步输出各阶段耗时, 滚动吞吐和内存, rank 0 同时写入 workdir 下的 jsonl
+        self.telemetry = StepTelemetry(
+            self.device, opj(self.workdir, f'{self.timestamp}_telemetry.jsonl') if self.rank == 0 else None,
+            window=self.log_interval)
+        # 日志步之间在设备上累加各项损失, 不同步
+        self.loss_keys, self.loss_sum, self.loss_count = None, None, 0
         self.train_valid_interval = self.train_cfg.get('train_valid_interval', 1)
 
         self.best_value = 0
         self.best_pth_path = opj(self.workdir, self.timestamp + '.pth')
+        # keep_best > 1 时最佳模型按 epoch 命名, best_pth_path 指向当前最佳; keep_last > 0 时每个 epoch 额外保存训练状态
+        checkpoint_cfg = self.train_cfg.get('checkpoint', {})
+        self.keep_best = checkpoint_cfg.get('keep_best', 1)
+        self.keep_last = checkpoint_cfg.get('keep_last', 0)
+        self.checkpoint_writer = CheckpointWriter(
+            keep_last=self.keep_last, keep_best=self.keep_best,
+            async_write=checkpoint_cfg.get('async', True)) if self.rank == 0 else None
+        # keep_last > 0 时每 interval 次参数更新在 epoch 中间保存一次训练状态, 收到 SIGTERM 时保存后退出
+        self.checkpoint_interval = checkpoint_cfg.get('interval', 0) if self.keep_last > 0 else 0
+        self.stop_requested = False
+        if self.keep_last > 0:
+            signal.signal(signal.SIGTERM, self._request_stop)
         self.select_metric = train_cfg.get('select_metric', 'f1').lower()
         assert self.select_metric in ['f1', 'iou', 'b_f1_iou', 'b_p_r_iou'], \
             f"select_metric must be one of 'f1', 'iou', 'b_f1_iou', 'b_p_r_iou', but got {self.select_metric}"
 
         self.save_infer_image = self.train_cfg.get('save_infer_image', False)
 
-    def _build_dataloader(self, cfg):
-        transform = self._build_transform(cfg['transform'])
+        # 异步验证: rank 0 在独立进程中验证权重快照, 结果返回后再选择并保存最佳模型
+        self.async_validator, self.valid_snapshots = self._build_async_validator(self.train_cfg.get('async_valid')), {}
+
+        # 断点续训: 当前 epoch 已训练的 batch 数和参数更新次数
+        self.resume_batch, self.resume_iter = 0, 0
+        if self.train_cfg.get('resume'):
+            self._resume(self.train_cfg['resume'])
+
+    def _build_dataloader(self, cfg, default_sampler=None, resumable=False):
+        transform = self._build_transform(cfg['transform'], cfg.get('cache'), cfg.get('timing', False))
+        if transform.cache is not None:
+            self.logger.info(f"Caching {len(transform.prefix)} deterministic transforms with "
+                             f"{transform.cache.__class__.__name__}, "
+                             f"random transforms: {[t.__class__.__name__ for t in transform.suffix]}")
         dataset = build_dataset(cfg['dataset'], dict(transform=transform, logger=self.logger))
         shuffle = cfg['dataloader'].get('shuffle', False)
         dataloader = build_dataloader(
-            cfg['dataloader'], self.gpu_num, self.distribute, dict(dataset=dataset, shuffle=shuffle)
+            cfg['dataloader'], self.gpu_num, self.distribute, dict(dataset=dataset, shuffle=shuffle),
+            default_sampler=default_sampler, resumable=resumable
         )
         return dataloader
 
+    def _wrap_model(self):
+        """分布式训练时用 DistributedDataParallel 包装模型, 可选把 BN 换成 NORMS 中的 SyncBN."""
+        if not self.distribute:
+            return
+        if self.base_cfg.get('sync_bn', False):
+            if self.device.type == 'cuda':
+                self.model = NORMS.get('SyncBN').convert_sync_batchnorm(self.model)
+                self.logger.info('Convert BatchNorm to SyncBN.')
+            else:
+                self.logger.warning('SyncBN needs cuda, keep BatchNorm on cpu.')
+        self.model = torch.nn.parallel.DistributedDataParallel(
+            self.model,
+            device_ids=[self.device.index] if self.device.type == 'cuda' else None,
+            broadcast_buffers=True,
+            find_unused_parameters=self.base_cfg.get('find_unused_parameters', False),
+        )
+        self.logger.info('Using DistributedDataParallel Training.')
+
+    @property
+    def model_without_ddp(self):
+        return self.model.module if isinstance(self.model, torch.nn.parallel.DistributedDataParallel) else self.model
+
+    def _build_batch_transform(self, cfg):
+        if cfg is None:
+            return None
+        cfg = cfg.copy()
+        normalize = self.train_dataloader.dataset.transform.transforms_dict.get('Normalize', None)
+        if normalize is not None:
+            # 默认使用逐样本 Normalize 的均值方差, 在 [0, 1] 空间做增强
+            cfg.setdefault('mean', normalize.mean.tolist())
+            cfg.setdefault('std', normalize.std.tolist())
+        batch_transform = BatchCompose(**cfg)
+        self.logger.info(f"Batch transforms on {'device' if batch_transform.on_device else 'cpu'}: "
+                         f"{[t.__class__.__name__ for t in batch_transform.transforms]}")
+        return batch_transform
+
+    def _build_ema(self, cfg):
+        """权重的指数滑动平均. eval 为 True 时验证, 最佳模型的保存和导出都使用 EMA 权重."""
+        if cfg is None:
+            return None, False
+        cfg = cfg.copy()
+        ema_eval = cfg.pop('eval', True)
+        ema = ModelEMA(self.model, **cfg)
+        self.logger.info(f"Weight EMA decay {ema.decay}, interval {ema.interval}, tau {ema.tau}, "
+                         f"valid and export with EMA weights: {ema_eval}")
+        return ema, ema_eval
+
+    def _build_async_validator(self, cfg):
+        if not cfg or self.rank != 0:
+            return None
+        cfg = dict(cfg) if isinstance(cfg, dict) else {}
+        device = cfg.get('device', str(self.device))
+        validator = AsyncValidator(self.inference_cfg['model'], self.train_cfg['valid'], device=device,
+                                   channels_last=self.channels_last, num_threads=cfg.get('num_threads'))
+        self.logger.info(f"Async validation on {device}, training does not wait for the valid results.")
+        return validator
+
+    def _optimizer_steps(self, num_batches):
+        return (num_batches + self.accumulate_steps - 1) // self.accumulate_steps
+
+    def _build_amp(self, mode):
+        """混合精度训练: None, 'fp16' (配合 GradScaler) 或 'bf16'. CPU 上只支持 bf16."""
+        if mode is None:
+            return None, None
+        assert mode in ['fp16', 'bf16'], f"amp must be one of None, 'fp16', 'bf16', but got {mode}"
+        if mode == 'fp16' and self.device.type != 'cuda':
+            self.logger.warning("fp16 autocast needs cuda, fall back to bf16 on cpu.")
+            mode = 'bf16'
+        dtype = torch.float16 if mode == 'fp16' else torch.bfloat16
+        # bf16 与 fp32 的指数范围相同, 不需要损失缩放
+        grad_scaler = torch.cuda.amp.GradScaler() if mode == 'fp16' else None
+        self.logger.info(f"Mixed precision training with {mode} autocast on {self.device.type}, "
+                         f"grad scaler: {grad_scaler is not None}")
+        return dtype, grad_scaler
+
     def _build_optimizer(self, cfg):
         return build_optimizer(cfg, dict(params=self.model.parameters()))
         # return build_optimizer(cfg, dict(params=[{'params':self.model.parameters(), 'lr':0.01}]))
@@ -103,87 +239,265 @@ class TrainRunner(InferenceRunner):
             else:
                 param['lr'] = val
 
+    def _request_stop(self, signum, frame):
+        self.logger.warning(f'Received signal {signum}, save training state and exit at the next log or checkpoint step (next step without DDP).')
+        self.stop_requested = True
+
+    def _stop(self):
+        if self.async_validator is not None:
+            self.async_validator.close(wait=False)
+        if self.rank == 0:
+            self.checkpoint_writer.wait()
+            self.checkpoint_writer.close()
+        self.logger.warning(f'Stopped at epoch {self.epoch} step {self.iter}, '
+                            f'resume with data.resume or --resume.')
+        raise SystemExit(128 + signal.SIGTERM)
+
+    def _save_last(self, num_batches=0):
+        """保存断点续训所需的完整训练状态. num_batches 为当前 epoch 已训练的 batch 数, 0 表示 epoch 已结束."""
+        if self.rank != 0:
+            return
+        suffix = f'_iter{self.iter}' if num_batches > 0 else ''
+        filename = opj(self.workdir, f'{self.timestamp}_last_epoch{self.epoch}{suffix}.pth')
+        meta = {
+            'epoch': self.epoch, 'batch': num_batches, 'iter': self.iter if num_batches > 0 else 0,
+            'global_step': self.global_step, 'best_value': float(self.best_value),
+            'best_metrics': getattr(self, 'best_metrics', None), 'threshold': getattr(self, 'threshold', None),
+            'best_pth_path': self.best_pth_path,
+        }
+        # 随机状态和采样器状态取自 rank 0
+        extra = {'rng': get_rng_state(), 'sampler': self.train_dataloader.batch_sampler.state_dict()}
+        if self.grad_scaler is not None:
+            extra['grad_scaler'] = self.grad_scaler.state_dict()
+        if self.ema is not None:
+            extra['ema'] = self.ema.state_dict()
+        self.checkpoint_writer.save(self.model, filename, optimizer=self.optimizer, lr_scheduler=self.lr_scheduler,
+                                    meta=meta, extra=extra)
+
+    def _resume(self, filename):
+        """从 _save_last 保存的文件恢复模型, 优化器, 学习率, GradScaler, 最佳指标, 随机状态和 epoch 内的位置."""
+        ckpt = load_checkpoint(self.model, filename, map_location='cpu')
+        if 'optimizer' in ckpt:
+            self.optimizer.load_state_dict(ckpt['optimizer'])
+        if 'lr_scheduler' in ckpt:
+            self.lr_scheduler.load_state_dict(ckpt['lr_scheduler'])
+        if self.grad_scaler is not None and 'grad_scaler' in ckpt:
+            self.grad_scaler.load_state_dict(ckpt['grad_scaler'])
+        if 'sampler' in ckpt:
+            self.train_dataloader.batch_sampler.load_state_dict(ckpt['sampler'])
+        if self.ema is not None:
+            if 'ema' in ckpt:
+                self.ema.load_state_dict(ckpt['ema'])
+            else:
+                self.ema.module.load_state_dict(self.model_without_ddp.state_dict())
+        if 'rng' in ckpt:
+            set_rng_state(ckpt['rng'])
+        meta = ckpt['meta']
+        self.best_value = meta.get('best_value', 0)
+        if meta.get('best_metrics') is not None:
+            self.best_metrics = meta['best_metrics']
+        if meta.get('threshold') is not None:
+            self.threshold = meta['threshold']
+        self.best_pth_path = meta.get('best_pth_path', self.best_pth_path)
+        self.global_step = meta.get('global_step', 0)
+        self.resume_batch, self.resume_iter = meta.get('batch', 0), meta.get('iter', 0)
+        self.logger.info(f'Resume from {filename}: epoch {self.epoch}, batch {self.resume_batch}, '
+                         f'step {self.global_step}, best {self.best_value:.4f}')
+
+    def _set_epoch(self):
+        for sampler in (self.train_dataloader.sampler, self.train_dataloader.batch_sampler):
+            if hasattr(sampler, 'set_epoch'):
+                sampler.set_epoch(self.epoch)
+
+    def _accumulate_losses(self):
+        keys = [k for k, v in self.losses.items() if isinstance(v, torch.Tensor) and v.dim() == 0]
+        packed = torch.stack([self.losses[k].detach().float() for k in keys])
+        if keys != self.loss_keys:
+            self.loss_keys, self.loss_sum, self.loss_count = keys, None, 0
+        self.loss_sum = packed if self.loss_sum is None else self.loss_sum + packed
+        self.loss_count += 1
+
+    def _reduce_losses(self):
+        """上次日志以来各项损失的均值, 所有 rank 打包成一个张量只做一次 all_reduce."""
+        if self.loss_sum is None:
+            return {}
+        losses = reduce_scalars(dict(zip(self.loss_keys, self.loss_sum / self.loss_count)), average=True)
+        self.loss_sum, self.loss_count = None, 0
+        return losses
+
     def echo_info(self):
+        record = self.telemetry.summary()
+        losses = self._reduce_losses()
+        loss = losses.get('loss', float('nan'))
         iter_info = f"{self.iter}/{self.iters}".ljust(8)
-        time_info = f"{(self.used_time * self.log_interval):.2f} sec".ljust(10)
-        loss_info = f"{self.losses['loss']:.4f}".ljust(10)
+        loss_info = f"{loss:.4f}".ljust(10)
         lr_info = f"{self.lr[0]:.6f}".ljust(10)
-        gpu_info = f"{(float(get_gpu_memroy([self.image.device.index])[0]['memory_used']) / 1024):.2f} GB".ljust(8)
-        self.logger.info(f"Step:{iter_info} Time:{time_info} Loss:{loss_info} Lr:{lr_info} GPU:{gpu_info}")
+        speed_info = f"{record['img_per_sec']:.1f} img/s".ljust(12)
+        time_info = ' '.join(f"{phase}:{t:.1f}" for phase, t in record['time_ms'].items())
+        memory_info = ' '.join(f"{k}:{v / 1024 ** 3:.2f}" for k, v in record['memory'].items())
+        self.logger.info(f"Step:{iter_info} Loss:{loss_info} Lr:{lr_info} Speed:{speed_info} "
+                         f"Time(ms) {time_info} Mem(GB) {memory_info}")
+        record.update(epoch=self.epoch, step=self.iter, global_step=self.global_step, loss=loss, lr=float(self.lr[0]),
+                      losses=losses)
+        self.telemetry.write(record)
 
     def _train(self):
-        self.iter = 0
+        # 断点续训时 DataLoader 跳过本 epoch 已训练的 batch, 累积分组和保存位置按整个 epoch 的 batch 序号计算
+        skipped = self.resume_batch
+        self.iter = self.resume_iter
+        self.resume_batch, self.resume_iter = 0, 0
+        # ImportanceSampler 每个 epoch 抽取的样本数可能变化
+        num_batches = skipped + len(self.train_dataloader)
+        self.iters = self._optimizer_steps(num_batches)
         self.model.train()
         line = '-' * 40
         self.logger.info(f'{line} Train Epoch {self.epoch + 1}/{self.max_epochs} {line}')
-        for batch_idx, batch_data in enumerate(self.train_dataloader):
+        if self.device.type == 'cuda':
+            torch.cuda.reset_peak_memory_stats(self.device)
+        epoch_images, epoch_time = 0, 0.
+        self.used_time, self.step_images = 0., 0
+        self.optimizer.zero_grad()
+        self.telemetry.begin()
+        for batch_idx, batch_data in enumerate(self.train_dataloader, skipped):
+            self.telemetry.mark('data', host=True)
+            self.telemetry.add('h2d', self.train_dataloader.copy_time)
             t1 = time.time()
+            timing = batch_data.pop(TIMING_KEY, None)
+            if timing is not None and self.transform_timing is not None:
+                self.transform_timing.update(timing)
+            self.image = batch_data['image']
+            self.mask = batch_data['mask']
+            if self.batch_transform is not None and self.batch_transform.on_device:
+                batch_data.update(self.batch_transform(image=self.image, mask=self.mask))
+                self.image, self.mask = batch_data['image'], batch_data['mask']
+            self.image = self._to_memory_format(self.image)
+
+            # 最后一组 micro-batch 可能不足 accumulate_steps 个, 按实际个数平均
+            group_start = batch_idx - batch_idx % self.accumulate_steps
+            group_size = min(self.accumulate_steps, num_batches - group_start)
+            boundary = batch_idx - group_start + 1 == group_size
+            # DDP 下非边界步跳过梯度 all-reduce
+            sync_context = self.model.no_sync() if not boundary and hasattr(self.model, 'no_sync') \
+                else contextlib.nullcontext()
+            with sync_context:
+                with torch.autocast(device_type=self.device.type, dtype=self.amp_dtype or torch.float32,
+                                    enabled=self.amp_dtype is not None):
+                    if self.importance_sampler is not None:
+                        index = batch_data['index']
+                        self.losses = self.model(
+                            self.image, return_metrics=True, ground_truth=self.mask,
+                            sample_weight=self.importance_sampler.weights(index, self.image.device),
+                            return_sample_losses=True)
+                        self.importance_sampler.update(index, self.losses.pop('sample_losses'))
+                    else:
+                        self.losses = self.model(self.image, return_metrics=True, ground_truth=self.mask)
+                loss = self.losses['loss'] / group_size
+                self._accumulate_losses()
+                self.telemetry.mark('forward')
+                if self.grad_scaler is not None:
+                    self.grad_scaler.scale(loss).backward()
+                else:
+                    loss.backward()
+                self.telemetry.mark('backward')
+            self.used_time += time.time() - t1
+            self.step_images += self.image.shape[0]
+            self.scale_throughput.update(self.image, time.time() - t1)
+            if not boundary:
+                continue
+
+            t2 = time.time()
+            if self.grad_scaler is not None:
+                self.grad_scaler.step(self.optimizer)
+                self.grad_scaler.update()
+            else:
+                self.optimizer.step()
             self.optimizer.zero_grad()
-            self.image = batch_data['image'].cuda()
-            self.mask = batch_data['mask'].cuda()
-            self.losses = self.model(self.image, return_metrics=True, ground_truth=self.mask)
-            self.losses['loss'].backward()
-            self.optimizer.step()
+            if self.ema is not None:
+                self.ema.update(self.model)
+            self.used_time += time.time() - t2
+            self.telemetry.mark('optimizer')
+            self.telemetry.step(self.step_images)
             self.iter += 1
-            self.used_time = time.time() - t1
-            if batch_idx % self.log_interval == 0 and batch_idx // self.log_interval > 0:
+            self.global_step += 1
+            epoch_images += self.step_images
+            epoch_time += self.used_time
+            if self.iter % self.log_interval == 0:
                 self.echo_info()
-
+                self._collect_valid()
+            self.used_time, self.step_images = 0., 0
+            save_step = self.checkpoint_interval > 0 and self.global_step % self.checkpoint_interval == 0
+            stop = False
+            if self.keep_last > 0 and (save_step or self.iter % self.log_interval == 0
+                                       or not is_dist_avail_and_initialized()):
+                # 信号可能只到达部分 rank, 只在打印/保存的步同步停止标志 (避免每步 all_reduce 和设备同步),
+                # 所有 rank 在同一次参数更新后保存并退出
+                self.stop_requested = stop = reduce_flag(self.stop_requested, self.device)
+            # epoch 的最后一个 batch 不在这里退出, 由 __call__ 在 epoch 结束时保存并退出
+            if batch_idx + 1 < num_batches:
+                if stop or save_step:
+                    self._save_last(batch_idx + 1)
+                if stop:
+                    self._stop()
+
+        if self.transform_timing is not None:
+            self.transform_timing.log(self.logger)
+            self.transform_timing.reset()
+        self.scale_throughput.log(self.logger)
+        self.scale_throughput.reset()
+        precision = {torch.float16: 'fp16', torch.bfloat16: 'bf16'}.get(self.amp_dtype, 'fp32')
+        self.logger.info(f"Epoch throughput ({precision}): {epoch_images / max(epoch_time, 1e-9):.1f} img/s, "
+                         f"peak memory {get_peak_memory(self.device) / 1024 ** 3:.2f} GB")
         self.lr_scheduler.step()
         pass
 
+    @property
+    def eval_model(self):
+        """验证和保存最佳模型使用的模型. 验证集已按 rank 切分, 使用未包装的模型, 避免 DDP 在各 rank 步数不同时同步."""
+        return self.ema.module if self.ema_eval else self.model_without_ddp
+
     def _valid(self, is_valid=True):
         line = '-' * 40
         if is_valid:
             self.logger.info(f"{line} Valid Epoch {self.epoch}/{self.max_epochs} {line}")
         else:
             self.logger.info(f"{line} Valid Infer Using TRT Model {line}")
-        self.model.eval()
-
-        all_seg_metrics_dict = dict()
-        for i in range(len(self.label2class)):
-            all_seg_metrics_dict[self.label2class[i]] = []
-
-        valid_iters = len(self.valid_dataloader)
-        interval = valid_iters // 10
-        with torch.no_grad():
-            for idx, batch_data in enumerate(self.valid_dataloader):
-                self.image = batch_data['image'].cuda()
-                self.mask = batch_data['mask'].numpy().astype(np.uint8)
-                if is_valid:
-                    probs = self.model(self.image).cpu().numpy()
-                else:
-                    probs = self.model(self.image)[0].cpu().numpy()
-                if len(self.class2label) > 1:
-                    # 多分类评估
-                    y_probs = np.transpose(probs, (0, 2, 3, 1))  # [B C H W] -> [B H W C]
-                    y_preds = np.argmax(y_probs, axis=-1).astype(np.uint8)
-                    y_trues = self.mask
-                    for class_idx in range(len(self.class2label)):
-                        metrics = []
-                        for y_pred, y_prob, y_true in zip(y_preds, y_probs, y_trues):
-                            mask = (y_true == class_idx).astype(np.uint8)
-                            if mask.sum() == 0:
-                                # GT 不存在， 计算召回是都为0，因此不参与计算
-                                continue
-                            prob = y_prob[..., class_idx]
-                            pred = (y_pred == class_idx).astype(np.uint8)
-                            metric, threshold_list = calculate_metric_for_more(prob, pred, mask)
-                            metrics.append(metric)
-                        all_seg_metrics_dict[self.label2class[class_idx]] += metrics
-                else:
-                    if 'background' not in all_seg_metrics_dict:
-                        all_seg_metrics_dict['background'] = []
-
-                    y_probs = probs
-                    y_trues = self.mask
-                    for y_prob, y_true in zip(y_probs, y_trues):
-                        metric, threshold_list = calculate_metric_for_one(y_prob, y_true)
-                        metrics.append(metric)
-                        all_seg_metrics_dict["foreground"] += [metric]
-                if idx % interval == 0 and idx // interval > 0:
-                    self.logger.info(f"Step:{idx}/{valid_iters}")
-        curr_metrics, best_index = parse_seg_metrics(all_seg_metrics_dict)
+        model = self.eval_model if is_valid else self.model_without_ddp
+        model.eval()
+
+        metric_acc, threshold_list = valid_loop(model, self.valid_dataloader, self.label2class, self.class2label,
+                                                is_valid=is_valid, preprocess=self._to_memory_format,
+                                                logger=self.logger)
+        # 各 rank 的指标累加量求和后再统计, 结果与单卡评估整个验证集一致
+        # 导出后的 TRT 验证只在 rank 0 上运行, 只统计 rank 0 的分片
+        if self.distribute and is_valid:
+            metric_acc = reduce_value(torch.from_numpy(metric_acc).to(self.device), average=False).cpu().numpy()
+        self._update_best(metric_acc, threshold_list, self.epoch, model, is_valid)
+
+    def _submit_valid(self):
+        """把验证用的权重快照交给验证进程, 训练不等待结果."""
+        if self.rank != 0:
+            return
+        state_dict = snapshot_to_cpu(self.eval_model.state_dict())
+        self.valid_snapshots[self.epoch] = state_dict
+        self.async_validator.submit(self.epoch, state_dict)
+        self.logger.info(f"Submitted epoch {self.epoch} to async validation, {self.async_validator.num_pending} pending.")
+
+    def _collect_valid(self, block=False):
+        """处理已完成的异步验证结果: 选择最佳模型并保存对应 epoch 的权重快照."""
+        if self.async_validator is None or self.rank != 0:
+            return
+        line = '-' * 40
+        for epoch, metric_acc, threshold_list, error in self.async_validator.poll(block):
+            state_dict = self.valid_snapshots.pop(epoch)
+            if error is not None:
+                self.logger.error(f"Async valid of epoch {epoch} failed!\n{error}")
+                continue
+            self.logger.info(f"{line} Async Valid Epoch {epoch}/{self.max_epochs} {line}")
+            self._update_best(metric_acc, threshold_list, epoch, state_dict)
+
+    def _update_best(self, metric_acc, threshold_list, epoch, model, is_valid=True):
+        """由指标累加量统计指标, 更新并保存最佳模型. model 可以是模块或 state_dict 快照."""
+        curr_metrics, best_index = parse_seg_accumulators(metric_acc, len(threshold_list))
 
         if self.select_metric == 'f1':
             curr_mean_metric = curr_metrics[-1, 5]
@@ -196,9 +510,15 @@ class TrainRunner(InferenceRunner):
             self.best_value = curr_mean_metric
             self.best_metrics = curr_metrics
             self.threshold = threshold_list[best_index]
-            meta = {'threshold': self.threshold}
-            save_checkpoint(self.model, self.best_pth_path, meta=meta)
-            self.logger.info(f'Saved best model to {self.best_pth_path} Threshold: {self.threshold:.2f}')
+            meta = {'threshold': self.threshold, 'epoch': epoch, 'best_value': float(self.best_value)}
+            if self.keep_best != 1:
+                self.best_pth_path = opj(self.workdir, f'{self.timestamp}_epoch{epoch}.pth')
+            if self.rank == 0:
+                # 启用 ema.eval 时保存 EMA 权重, _export 从最佳模型导出即得到 EMA 权重
+                snapshot_time = self.checkpoint_writer.save(
+                    model, self.best_pth_path, meta=meta, score=float(self.best_value))
+                self.logger.info(f'Saved best model to {self.best_pth_path} Threshold: {self.threshold:.2f} '
+                                 f'(snapshot {snapshot_time:.2f} sec)')
         parse_seg_metrics_to_table(curr_metrics, self.best_metrics[-1, :], self.label2class, self.logger)
 
     def _torch2onnx(self):
@@ -208,8 +528,8 @@ class TrainRunner(InferenceRunner):
         ckpt = load_checkpoint(self.model, self.best_pth_path)
         threshold = ckpt['meta']['threshold']
         onnx_cfg = dict(
-            model=self.model,
-            dummy_input=torch.ones(1, 3, height, width).cuda(),
+            model=self._eager_model(self.model_without_ddp),
+            dummy_input=torch.ones(1, 3, height, width, device=self.device),
             onnx_model_name=self.best_pth_path.replace('.pth', '.onnx'),
             opset_version=17
         )
@@ -244,8 +564,8 @@ class TrainRunner(InferenceRunner):
             # threshold = ckpt['meta']['threshold']
             onnx_path = self.best_pth_path.replace('.pth', '.onnx')
             onnx_cfg = dict(
-                model=self.model,
-                dummy_input=torch.ones(1, 3, height, width).cuda(),
+                model=self._eager_model(self.model_without_ddp),
+                dummy_input=torch.ones(1, 3, height, width, device=self.device),
                 onnx_model_name=onnx_path,
                 opset_version=self.export_cfg['onnx']['opset_version']
             )
@@ -295,19 +615,39 @@ class TrainRunner(InferenceRunner):
     def __call__(self, *args, **kwargs):
         start_time = time.time()
         for _ in range(self.epoch, self.max_epochs):
-            if hasattr(self.train_dataloader.sampler, 'set_epoch'):
-                self.train_dataloader.sampler.set_epoch(self.epoch)
+            self._set_epoch()
+            if self.resume_batch > 0:
+                self.train_dataloader.batch_sampler.skip_batches(self.resume_batch)
             t1 = time.time()
             self._train()
 
             if self.epoch % self.train_valid_interval == 0:
-                self._valid()
+                if self.train_cfg.get('async_valid'):
+                    self._submit_valid()
+                else:
+                    self._valid()
+            self._collect_valid()
+            if self.keep_last > 0:
+                # 先在所有 rank 上为下一个 epoch 抽样, 保存的采样器状态即下一个 epoch 开始时的状态
+                self._set_epoch()
+                self._save_last()
+                self.stop_requested = reduce_flag(self.stop_requested, self.device)
+                if self.stop_requested:
+                    self._stop()
             train_valid_time = time.time() - t1
 
             eta_string = str(datetime.timedelta(seconds=int(train_valid_time * (self.max_epochs - self.epoch))))
             self.logger.info(f"ETA:{eta_string}")
 
+        # 等待剩余的异步验证结果, 最佳模型确定后再导出
+        self._collect_valid(block=True)
+        if self.async_validator is not None:
+            self.async_validator.close()
         total_time = datetime.timedelta(seconds=int(time.time() - start_time))
         self.logger.info(f'End training. Total training time: {total_time}')
 
-        self._export()
+        if self.rank == 0:
+            # 导出前等待后台线程把最佳模型写完
+            self.checkpoint_writer.wait()
+            self.checkpoint_writer.close()
+            self._export()
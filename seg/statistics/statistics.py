@@ -36,4 +36,26 @@ class ClsStatistics:
         mean_std = np.array(mean_std, dtype=np.float64)
         self.mean = [round(float(i), 3) for i in np.mean(mean_std[:, :, 0], axis=0)]
         self.std = [round(float(i), 3) for i in np.mean(mean_std[:, :, 1], axis=0)]
-        logger.info(f'Calculate mean and stds done. mean: {self.mean}, std: {self.std}')
\ No newline at end of file
+        logger.info(f'Calculate mean and stds done. mean: {self.mean}, std: {self.std}')
+
+class ScaleThroughput:
+    """按输入分辨率统计训练吞吐 (images/s, pixels/s), 多尺度训练时每个 epoch 输出一次."""
+
+    def __init__(self):
+        self.records = dict()
+
+    def reset(self):
+        self.records = dict()
+
+    def update(self, image, seconds):
+        scale = tuple(image.shape[-2:])
+        steps, images, used_time = self.records.get(scale, (0, 0, 0.))
+        self.records[scale] = (steps + 1, images + image.shape[0], used_time + seconds)
+
+    def log(self, logger):
+        if len(self.records) < 2:
+            return
+        for (h, w), (steps, images, used_time) in sorted(self.records.items()):
+            used_time = max(used_time, 1e-9)
+            logger.info(f"Scale:{f'{h}x{w}'.ljust(10)} Steps:{str(steps).ljust(6)} "
+                        f"Images/s:{images / used_time:.1f} Pixels/s:{images * h * w / used_time / 1e6:.1f}M")
@@ -0,0 +1,128 @@
+import json
+import time
+from collections import deque, OrderedDict
+import torch
+from seg.utils.gpu import get_peak_memory, get_rss
+
+PHASES = ('data', 'h2d', 'forward', 'backward', 'optimizer')
+
+
+class StepTelemetry:
+    """Per-step timing, throughput and memory measured inside the training process.
+
+    The training loop calls ``mark(phase)`` at the end of every phase, the time
+    since the previous mark is charged to ``phase``. On CUDA a mark also records
+    an event on the current stream and device phases are measured between events,
+    so the asynchronous kernels are timed without synchronizing every step; the
+    events are only resolved in ``summary``, i.e. on log steps. Phases that block
+    the host, such as waiting for the DataLoader, are marked with ``host=True``.
+    Copies timed elsewhere (the side stream of :class:`DevicePrefetcher`) are
+    added with ``add``. Memory is read from the torch allocator and the process
+    RSS, no ``nvidia-smi`` subprocess is started.
+
+    Args:
+        device (str | torch.device): Training device.
+        jsonl_path (str, optional): File to append one JSON record per summary.
+        window (int): Optimizer steps of the rolling throughput. Defaults to 50.
+    """
+
+    def __init__(self, device, jsonl_path=None, window=50):
+        self.device = torch.device(device)
+        self.use_events = self.device.type == 'cuda' and torch.cuda.is_available()
+        self.jsonl_path = jsonl_path
+        self.window = deque(maxlen=max(window, 1))
+        self.reset()
+
+    def reset(self):
+        self.pending = []  # (phase, start, end), 秒数或 cuda Event
+        self.totals = OrderedDict((phase, 0.) for phase in PHASES)
+        self.steps = 0
+        self.last = None
+        self.step_start = None
+
+    def _now(self):
+        event = None
+        if self.use_events:
+            event = torch.cuda.Event(enable_timing=True)
+            event.record(torch.cuda.current_stream(self.device))
+        return time.perf_counter(), event
+
+    def begin(self):
+        """Call right before iterating the DataLoader of an epoch, the rolling throughput is kept."""
+        self.pending = []
+        self.totals = OrderedDict((phase, 0.) for phase in PHASES)
+        self.steps = 0
+        self.last = self._now()
+        self.step_start = self.last[0]
+
+    def mark(self, phase, host=False):
+        now = self._now()
+        if host or not self.use_events:
+            self.pending.append((phase, self.last[0], now[0]))
+        else:
+            self.pending.append((phase, self.last[1], now[1]))
+        self.last = now
+
+    def add(self, phase, value):
+        """``value`` is a number of seconds or a (start, end) pair of cuda events."""
+        if value is None:
+            return
+        if isinstance(value, tuple):
+            self.pending.append((phase,) + value)
+        else:
+            self.pending.append((phase, 0., value))
+
+    def step(self, images):
+        """Call after every optimizer step with the number of images of the step."""
+        now = time.perf_counter()
+        self.window.append((images, now - self.step_start))
+        self.step_start = now
+        self.steps += 1
+
+    def _resolve(self):
+        if len(self.pending) == 0:
+            return
+        if self.use_events:
+            torch.cuda.synchronize(self.device)
+        for phase, start, end in self.pending:
+            if isinstance(start, torch.cuda.Event):
+                seconds = start.elapsed_time(end) / 1000
+            else:
+                seconds = end - start
+            self.totals[phase] = self.totals.get(phase, 0.) + seconds
+        self.pending = []
+
+    @property
+    def images_per_sec(self):
+        images = sum(w[0] for w in self.window)
+        seconds = sum(w[1] for w in self.window)
+        return images / max(seconds, 1e-9)
+
+    def memory(self):
+        """Memory in bytes: process RSS, peak, and on CUDA the allocator's allocated/reserved bytes."""
+        info = OrderedDict(rss=get_rss(), peak=get_peak_memory(self.device))
+        if self.use_events:
+            stats = torch.cuda.memory_stats(self.device)
+            info['allocated'] = stats.get('allocated_bytes.all.current', 0)
+            info['reserved'] = stats.get('reserved_bytes.all.current', 0)
+        return info
+
+    def summary(self):
+        """Mean time per optimizer step of every phase (ms) since the last summary, throughput and memory."""
+        self._resolve()
+        steps = max(self.steps, 1)
+        record = OrderedDict(
+            steps=self.steps,
+            img_per_sec=round(self.images_per_sec, 2),
+            time_ms=OrderedDict((phase, round(t / steps * 1000, 3)) for phase, t in self.totals.items()),
+            memory=self.memory(),
+        )
+        self.totals = OrderedDict((phase, 0.) for phase in self.totals)
+        self.steps = 0
+        return record
+
+    def write(self, record):
+        if self.jsonl_path is None:
+            return
+        with open(self.jsonl_path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
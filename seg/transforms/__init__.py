@@ -1,3 +1,4 @@
 from .augmentations import *
+from .cache import *
 from .compose import *
 from .builder import *
\ No newline at end of file
@@ -1 +1,2 @@
-from .transforms import *
\ No newline at end of file
+from .transforms import *
+from .batch_transforms import *
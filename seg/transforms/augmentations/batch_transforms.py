@@ -0,0 +1,220 @@
+import math
+import random
+import torch
+from ..builder import TRANSFORMS
+
+
+def _uniform(low, high, size, device):
+    return torch.empty(size, device=device).uniform_(low, high)
+
+
+def _gray(image):
+    if image.shape[1] == 1:
+        return image
+    weight = image.new_tensor([0.299, 0.587, 0.114]).view(1, 3, 1, 1)
+    return (image * weight).sum(dim=1, keepdim=True)
+
+
+def _where(apply, new, old):
+    return torch.where(apply.view(-1, *([1] * (old.dim() - 1))), new, old)
+
+
+class BaseBatchTransform:
+    """Base class of the batch augmentation stage.
+
+    Batch transforms work on collated tensors, ``image`` [B, C, H, W] in [0, 1] and
+    ``mask`` [B, H, W], and draw their random parameters per sample with vectorized
+    torch ops, so the cost does not grow with one Python call per image. ``p`` and
+    ``always_apply`` have the same meaning as for the per-sample transforms, but are
+    evaluated for every sample of the batch. Pixel-valued arguments (noise variance,
+    fill value) use the 0-255 units of the per-sample transforms and are divided by
+    ``max_value``.
+    """
+
+    def __init__(self, always_apply=False, p=0.5, max_value=255., **kwargs):
+        self.always_apply = always_apply
+        self.p = p
+        self.max_value = max_value
+
+    def _apply_mask(self, batch_size, device):
+        if self.always_apply or self.p >= 1:
+            return torch.ones(batch_size, dtype=torch.bool, device=device)
+        return torch.rand(batch_size, device=device) < self.p
+
+    def apply(self, image, mask, apply):
+        raise NotImplementedError
+
+    def __call__(self, image, mask=None, **kwargs):
+        apply = self._apply_mask(image.shape[0], image.device)
+        image, mask = self.apply(image, mask, apply)
+        kwargs.update(image=image)
+        if mask is not None:
+            kwargs.update(mask=mask)
+        return kwargs
+
+
+@TRANSFORMS.register_module()
+class BatchColorJitter(BaseBatchTransform):
+    """Per-sample brightness, contrast, saturation and hue jitter.
+
+    The order of the four ops is shuffled once per batch. Hue is shifted by a
+    rotation in YIQ space, which is linear and therefore vectorizes across the batch.
+    """
+
+    def __init__(self,
+                 brightness=0.2,
+                 contrast=0.2,
+                 saturation=0.2,
+                 hue=0.2,
+                 **kwargs):
+        super(BatchColorJitter, self).__init__(**kwargs)
+        self.brightness = self._check_values(brightness, "brightness")
+        self.contrast = self._check_values(contrast, "contrast")
+        self.saturation = self._check_values(saturation, "saturation")
+        self.hue = self._check_values(hue, "hue", offset=0, bounds=[-0.5, 0.5], clip=False)
+
+    @staticmethod
+    def _check_values(value, name, offset=1, bounds=(0, float("inf")), clip=True):
+        if isinstance(value, (int, float)):
+            if value < 0:
+                raise ValueError(f"If {name} is a single number, it must be positive")
+            value = [offset - value, offset + value]
+            if clip:
+                value[0] = max(value[0], 0)
+        elif isinstance(value, (tuple, list)) and len(value) == 2:
+            if not bounds[0] <= value[0] <= value[1] <= bounds[1]:
+                raise ValueError("{} values should be between {}".format(name, bounds))
+        else:
+            raise TypeError("{} should be a single number or a list/tuple with length 2.".format(name))
+        return value
+
+    def _brightness(self, image):
+        factor = _uniform(*self.brightness, image.shape[0], image.device).view(-1, 1, 1, 1)
+        return (image * factor).clamp(0, 1)
+
+    def _contrast(self, image):
+        factor = _uniform(*self.contrast, image.shape[0], image.device).view(-1, 1, 1, 1)
+        mean = _gray(image).mean(dim=(1, 2, 3), keepdim=True)
+        return (image * factor + mean * (1 - factor)).clamp(0, 1)
+
+    def _saturation(self, image):
+        factor = _uniform(*self.saturation, image.shape[0], image.device).view(-1, 1, 1, 1)
+        return (image * factor + _gray(image) * (1 - factor)).clamp(0, 1)
+
+    def _hue(self, image):
+        if image.shape[1] != 3:
+            return image
+        theta = _uniform(*self.hue, image.shape[0], image.device) * 2 * math.pi
+        cos, sin = torch.cos(theta), torch.sin(theta)
+        rgb2yiq = image.new_tensor([[0.299, 0.587, 0.114],
+                                    [0.596, -0.274, -0.322],
+                                    [0.211, -0.523, 0.312]])
+        rotation = torch.zeros(image.shape[0], 3, 3, device=image.device, dtype=image.dtype)
+        rotation[:, 0, 0] = 1
+        rotation[:, 1, 1], rotation[:, 1, 2] = cos, -sin
+        rotation[:, 2, 1], rotation[:, 2, 2] = sin, cos
+        matrix = torch.linalg.inv(rgb2yiq) @ rotation @ rgb2yiq
+        return torch.einsum('bij,bjhw->bihw', matrix, image).clamp(0, 1)
+
+    def apply(self, image, mask, apply):
+        ops = [self._brightness, self._contrast, self._saturation, self._hue]
+        random.shuffle(ops)
+        out = image
+        for op in ops:
+            out = op(out)
+        return _where(apply, out, image), mask
+
+
+@TRANSFORMS.register_module()
+class BatchGaussNoise(BaseBatchTransform):
+    def __init__(self, var_limit=(10.0, 50.0), mean=0, **kwargs):
+        super(BatchGaussNoise, self).__init__(**kwargs)
+        if isinstance(var_limit, (int, float)):
+            var_limit = (0, var_limit)
+        if var_limit[0] < 0 or var_limit[1] < 0:
+            raise ValueError("var_limit should be non negative.")
+        self.var_limit = var_limit
+        self.mean = mean
+
+    def apply(self, image, mask, apply):
+        sigma = _uniform(*self.var_limit, image.shape[0], image.device).sqrt().view(-1, 1, 1, 1)
+        noise = torch.randn_like(image) * sigma + self.mean
+        out = (image + noise / self.max_value).clamp(0, 1)
+        return _where(apply, out, image), mask
+
+
+@TRANSFORMS.register_module()
+class BatchHorizontalFlip(BaseBatchTransform):
+    def apply(self, image, mask, apply):
+        image = _where(apply, image.flip(-1), image)
+        if mask is not None:
+            mask = _where(apply, mask.flip(-1), mask)
+        return image, mask
+
+
+@TRANSFORMS.register_module()
+class BatchVerticalFlip(BaseBatchTransform):
+    def apply(self, image, mask, apply):
+        image = _where(apply, image.flip(-2), image)
+        if mask is not None:
+            mask = _where(apply, mask.flip(-2), mask)
+        return image, mask
+
+
+@TRANSFORMS.register_module()
+class BatchCenterFlip(BaseBatchTransform):
+    def apply(self, image, mask, apply):
+        image = _where(apply, image.flip(-2, -1), image)
+        if mask is not None:
+            mask = _where(apply, mask.flip(-2, -1), mask)
+        return image, mask
+
+
+@TRANSFORMS.register_module()
+class BatchRandomCutout(BaseBatchTransform):
+    """Batch version of :class:`RandomCutout`, holes are drawn independently per sample."""
+
+    def __init__(self, n_holes=1, cutout_shape=None, cutout_ratio=(0.1, 0.1), fill_in=0, **kwargs):
+        super(BatchRandomCutout, self).__init__(**kwargs)
+        assert (cutout_shape is None) ^ (cutout_ratio is None), \
+            'Either cutout_shape or cutout_ratio should be specified.'
+        if isinstance(n_holes, (tuple, list)):
+            assert len(n_holes) == 2 and 0 <= n_holes[0] <= n_holes[1]
+        else:
+            n_holes = (n_holes, n_holes)
+        self.n_holes = n_holes
+        self.fill_in = fill_in
+        self.with_ratio = cutout_ratio is not None
+        candidates = cutout_ratio if self.with_ratio else cutout_shape
+        if not isinstance(candidates[0], (list, tuple)):
+            candidates = [candidates]
+        self.candidates = candidates
+
+    def apply(self, image, mask, apply):
+        batch_size, channels, height, width = image.shape
+        device = image.device
+        candidates = torch.tensor(self.candidates, dtype=torch.float32, device=device)
+        if self.with_ratio:
+            candidates = candidates * candidates.new_tensor([width, height])
+        n_holes = torch.randint(self.n_holes[0], self.n_holes[1] + 1, (batch_size,), device=device)
+        yy = torch.arange(height, device=device).view(1, height, 1)
+        xx = torch.arange(width, device=device).view(1, 1, width)
+
+        region = torch.zeros(batch_size, height, width, dtype=torch.bool, device=device)
+        for k in range(self.n_holes[1]):
+            x1 = torch.randint(0, width, (batch_size,), device=device)
+            y1 = torch.randint(0, height, (batch_size,), device=device)
+            size = candidates[torch.randint(0, len(candidates), (batch_size,), device=device)].long()
+            x2, y2 = x1 + size[:, 0], y1 + size[:, 1]
+            hole = (xx >= x1.view(-1, 1, 1)) & (xx < x2.view(-1, 1, 1)) & \
+                   (yy >= y1.view(-1, 1, 1)) & (yy < y2.view(-1, 1, 1))
+            region |= hole & (k < n_holes).view(-1, 1, 1)
+        region &= apply.view(-1, 1, 1)
+
+        fill_in = image.new_tensor(self.fill_in).flatten() / self.max_value
+        fill_in = fill_in.view(1, -1, 1, 1).expand(batch_size, channels, height, width)
+        image = torch.where(region.unsqueeze(1), fill_in, image)
+        if mask is not None:
+            region_mask = region.view(batch_size, *([1] * (mask.dim() - 3)), height, width)
+            mask = torch.where(region_mask, mask.new_tensor(self.fill_in).flatten()[0], mask)
+        return image, mask
@@ -1,4 +1,5 @@
 import cv2
+import random
 import numpy as np
 from scipy.ndimage import interpolation
 
@@ -26,6 +27,12 @@ def resize(image, height, width, interpolation=cv2.INTER_LINEAR):
     return image
 
 
+def keep_ratio_size(image_height, image_width, height, width):
+    """保持宽高比缩放到 (height, width) 以内时的输出尺寸."""
+    ratio = min(height / image_height, width / image_width)
+    return max(int(round(image_height * ratio)), 1), max(int(round(image_width * ratio)), 1)
+
+
 def padding_resize(image, height, width, interpolation=cv2.INTER_LINEAR):
     if image.ndim == 2:
         image_height, image_width = image.shape
@@ -205,6 +212,41 @@ def random_crop_padding(image, crop_height, crop_width, h_start, w_start, border
                                         borderType=border_type, value=value)
     return crop_img
 
+def flip_foreground_index(fg_index, horizontal=False, vertical=False):
+    """
+    翻转前景索引. fg_index: dict[class_name, ndarray[K, 4]], 每行是归一化到 [0, 1] 的 (x1, y1, x2, y2).
+    """
+    flipped = dict()
+    for name, boxes in fg_index.items():
+        boxes = boxes.copy()
+        if horizontal:
+            boxes[:, [0, 2]] = 1. - boxes[:, [2, 0]]
+        if vertical:
+            boxes[:, [1, 3]] = 1. - boxes[:, [3, 1]]
+        flipped[name] = boxes
+    return flipped
+
+
+def sample_foreground_point(fg_index, class_weights=None):
+    """
+    从前景索引中采样一个归一化坐标 (x, y), 没有前景时返回 None.
+    class_weights 为 None 时所有目标框等概率; 否则先按类别权重选类别, 再在该类别中等概率选框,
+    用于提高稀有缺陷类别被裁剪到的概率.
+    """
+    names = [name for name, boxes in fg_index.items() if len(boxes) > 0]
+    if len(names) == 0:
+        return None
+    if class_weights is None:
+        weights = [len(fg_index[name]) for name in names]
+    else:
+        weights = [class_weights.get(name, 1.) for name in names]
+    if sum(weights) <= 0:
+        return None
+    boxes = fg_index[random.choices(names, weights=weights)[0]]
+    x1, y1, x2, y2 = boxes[random.randrange(len(boxes))]
+    return random.uniform(x1, x2), random.uniform(y1, y2)
+
+
 def _multiply_non_uint8(img, multiplier):
     dtype = img.dtype
     maxval = MAX_VALUES_BY_DTYPE.get(dtype, 1.0)
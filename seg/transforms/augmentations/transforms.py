@@ -1,3 +1,4 @@
+import time
 import torch
 import random
 import numpy as np
@@ -7,6 +8,10 @@ from ..builder import TRANSFORMS
 
 
 class BaseTransform:
+    # Compose 开启计时时写入的单样本计时行 [total, image, mask], 关闭时为 None
+    timer = None
+    timer_slots = {'image': 1, 'images': 1, 'mask': 2, 'masks': 2}
+
     def __init__(self, always_apply=False, p=0.5, **kwargs):
         self.always_apply = always_apply
         self.p = p
@@ -18,9 +23,19 @@ class BaseTransform:
             "mask": self.apply_to_mask,
             "images": self.apply_to_images,
             "masks": self.apply_to_masks,
-            "boxes": self.apply_to_bboxes
+            "boxes": self.apply_to_bboxes,
+            "fg_index": self.apply_to_fg_index,
         }
 
+    @property
+    def deterministic(self):
+        """bool: Whether every call maps the same input to the same output."""
+        return False
+
+    @property
+    def _always_applied(self):
+        return self.always_apply or self.p >= 1
+
     def get_params(self, **kwargs):
         return {}
 
@@ -45,36 +60,71 @@ class BaseTransform:
     def apply_to_bboxes(self, bboxes, **kwargs):
         return [self.apply_to_bbox(bbox[:4], **kwargs) for bbox in bboxes]
 
+    def apply_to_fg_index(self, fg_index, **kwargs):
+        # 前景索引(见 DPST.fg_index)默认在几何变换后失效, 丢弃后 RandomCrop 会退回到扫描 mask
+        return None
+
     def __call__(self, *args, force_apply=False, **kwargs):
         if args:
             raise KeyError("You have to pass data to augmentations as named arguments, for example: aug(image=image)")
         if (random.random() < self.p) or self.always_apply or force_apply:
             params = self.get_params(**kwargs)
             res = {}
+            timer = self.timer
             for key, arg in kwargs.items():
                 if arg is not None:
                     target_function = self._get_target_function(key)
-                    res[key] = target_function(arg, **params)
+                    if timer is None:
+                        res[key] = target_function(arg, **params)
+                    else:
+                        t0 = time.perf_counter()
+                        res[key] = target_function(arg, **params)
+                        slot = self.timer_slots.get(key)
+                        if slot is not None:
+                            timer[slot] += time.perf_counter() - t0
             return res
         return kwargs
 
 
 @TRANSFORMS.register_module()
 class Resize(BaseTransform):
-    def __init__(self, height, width, interpolation=cv2.INTER_LINEAR, padding=0., prob=1., always_apply=False):
+    def __init__(self, height, width, interpolation=cv2.INTER_LINEAR, padding=0., prob=1., always_apply=False,
+                 keep_ratio=False):
+        """
+        keep_ratio (bool): 为 True 时保持宽高比缩放到 (height, width) 以内, 输出尺寸随样本变化,
+            需要配合 AspectRatioBucketSampler 和 PaddedCollate 组 batch.
+        """
         super(Resize, self).__init__(always_apply, prob)
         self.height = height
         self.width = width
         self.interpolation = interpolation
         self.padding = padding
+        self.keep_ratio = keep_ratio
+
+    @property
+    def deterministic(self):
+        return self._always_applied and self.padding in (0, 1)
+
+    def _target_size(self, rows, cols, target_size=None):
+        # target_size 由 MultiScaleBatchSampler 按 batch 指定, 覆盖配置中的 (height, width)
+        height, width = (self.height, self.width) if target_size is None else target_size
+        if not self.keep_ratio:
+            return height, width
+        return keep_ratio_size(rows, cols, height, width)
 
     def apply(self, image, **kwargs):
-        return padding_resize(image, self.height, self.width, self.interpolation) if kwargs.get('padding') else resize(
-            image, self.height, self.width, self.interpolation)
+        height, width = self._target_size(kwargs['rows'], kwargs['cols'], kwargs.get('target_size'))
+        return padding_resize(image, height, width, self.interpolation) if kwargs.get('padding') else resize(
+            image, height, width, self.interpolation)
 
     def apply_to_mask(self, mask, **kwargs):
-        return padding_resize_mask(mask, self.height, self.width, self.interpolation) if kwargs.get(
-            'padding') else resize(mask, self.height, self.width, cv2.INTER_NEAREST)
+        height, width = self._target_size(kwargs['rows'], kwargs['cols'], kwargs.get('target_size'))
+        return padding_resize_mask(mask, height, width, self.interpolation) if kwargs.get(
+            'padding') else resize(mask, height, width, cv2.INTER_NEAREST)
+
+    def apply_to_fg_index(self, fg_index, **kwargs):
+        # 归一化坐标在直接 resize 后保持不变
+        return None if kwargs.get('padding') else fg_index
 
     def get_params(self, **kwargs):
         padding = random.random() < self.padding
@@ -83,12 +133,14 @@ class Resize(BaseTransform):
                 'cols': kwargs['image'].shape[1],
                 'rows': kwargs['image'].shape[0],
                 'padding': padding,
+                'target_size': kwargs.get('target_size'),
             }
         elif 'images' in kwargs.keys():
             return {
                 'cols': kwargs['images'][0].shape[1],
                 'rows': kwargs['images'][0].shape[0],
                 'padding': padding,
+                'target_size': kwargs.get('target_size'),
             }
         else:
             raise ValueError('No image or images in Resize')
@@ -105,6 +157,9 @@ class HorizontalFlip(BaseTransform):
     def apply_to_mask(self, mask):
         return hflip(mask)
 
+    def apply_to_fg_index(self, fg_index, **kwargs):
+        return flip_foreground_index(fg_index, horizontal=True)
+
     def get_params(self, **kwargs):
         if kwargs.get('image', None):
             return {
@@ -131,6 +186,9 @@ class VerticalFlip(BaseTransform):
     def apply_to_mask(self, mask):
         return vflip(mask)
 
+    def apply_to_fg_index(self, fg_index, **kwargs):
+        return flip_foreground_index(fg_index, vertical=True)
+
     def get_params(self, **kwargs):
         if kwargs.get('image', None):
             return {
@@ -157,6 +215,9 @@ class CenterFlip(BaseTransform):
     def apply_to_mask(self, mask):
         return cflip(mask)
 
+    def apply_to_fg_index(self, fg_index, **kwargs):
+        return flip_foreground_index(fg_index, horizontal=True, vertical=True)
+
     def get_params(self, **kwargs):
         if kwargs.get('image', None):
             return {
@@ -282,8 +343,15 @@ class RandomCrop(BaseTransform):
                  crop_width=0,
                  crop_object=False,
                  crop_object_ratio=1.0,
+                 class_weights=None,
                  **kwargs):
-        super(RandomCrop).__init__(**kwargs)
+        """
+        crop_object (bool): 是否以目标为中心裁剪. 样本带有 ``fg_index`` (DPST 加载时由标注预先计算的
+            每类目标框) 时直接从中采样中心点, 否则扫描 mask/阈值化后的图像.
+        class_weights (dict, optional): 类别名到采样权重的映射, 例如 {"posun": 5, "SCT": 5},
+            未列出的类别权重为 1. 为 None 时所有目标框等概率.
+        """
+        super(RandomCrop, self).__init__(**kwargs)
         self.height_ratio = height_ratio
         self.width_ratio = width_ratio
         self.padding = padding
@@ -291,6 +359,7 @@ class RandomCrop(BaseTransform):
         self.crop_width = crop_width
         self.crop_object = crop_object
         self.crop_object_ratio = crop_object_ratio
+        self.class_weights = class_weights
 
     def apply(self, image, crop_height, crop_width, h_start=0, w_start=0, **kwargs):
         return random_crop(image, crop_height, crop_width, h_start, w_start) if not self.padding \
@@ -300,8 +369,20 @@ class RandomCrop(BaseTransform):
         return random_crop(mask, crop_height, crop_width, h_start, w_start) if not self.padding \
             else random_crop_padding(mask, crop_height, crop_width, h_start, w_start)
 
-    def _get_yy_xx(self, params):
-        if self.crop_object_ratio > random.random():
+    def _get_object_center(self, params, height, width):
+        use_object = self.crop_object_ratio > random.random()
+        fg_index = params.get("fg_index", None)
+        if use_object and fg_index is not None:
+            point = sample_foreground_point(fg_index, self.class_weights)
+            if point is None:
+                raise ValueError('No foreground in fg_index')
+            return point[0] * width, point[1] * height
+        yy, xx = self._get_yy_xx(params, use_object)
+        index = random.randint(0, len(yy) - 1)
+        return xx[index], yy[index]
+
+    def _get_yy_xx(self, params, use_object):
+        if use_object:
             if "mask" in params:
                 mask = params["mask"]
             elif "masks" in params and len(params["masks"]) > 0:
@@ -333,9 +414,8 @@ class RandomCrop(BaseTransform):
         no_object = True
         if self.crop_object:
             try:
-                yy, xx = self._get_yy_xx(kwargs)
-                index = random.randint(0, len(yy) - 1)
-                coord = [max(int(xx[index] - crop_width * 0.5), 0), max(int(yy[index] - crop_height * 0.5), 0)]
+                x, y = self._get_object_center(kwargs, height, width)
+                coord = [max(int(x - crop_width * 0.5), 0), max(int(y - crop_height * 0.5), 0)]
                 w_start = min(coord[0] / (width - crop_width), 1.)
                 h_start = min(coord[1] / (height - crop_height), 1.)
                 no_object = False
@@ -356,6 +436,10 @@ class RandomCrop(BaseTransform):
 
 @TRANSFORMS.register_module()
 class CenterCrop(RandomCrop):
+    @property
+    def deterministic(self):
+        return self._always_applied
+
     def get_params(self, **params):
         height, width = params["image"].shape[:2] if params.get("image", None) is not None \
             else params.get("images")[0].shape[:2]
@@ -499,6 +583,9 @@ class RandomCutout(BaseTransform):
     def apply_to_mask(self, img, **kwargs):
         return random_cutout(img, **kwargs)
 
+    def apply_to_fg_index(self, fg_index, **kwargs):
+        return fg_index
+
     def get_params(self, **kwargs):
         height, width = kwargs["image"].shape[:2] if kwargs.get("image", None) is not None else kwargs.get("images")[
                                                                                                     0].shape[:2]
@@ -536,6 +623,10 @@ class Normalize(BaseTransform):
         self.stds = stds
         self.scale = scale
 
+    @property
+    def deterministic(self):
+        return self._always_applied
+
     @property
     def targets(self):
         return {'image': self.apply, 'images': self.apply_to_images}
@@ -560,6 +651,10 @@ class ToTensor(BaseTransform):
         super(ToTensor, self).__init__(**kwargs)
         self.transpose_mask = transpose_mask
 
+    @property
+    def deterministic(self):
+        return self._always_applied
+
     def apply(self, image, **kwargs):
         if len(image.shape) not in [2, 3]:
             raise ValueError(f"ToTensor only supports images in HW or HWC format")
@@ -1,7 +1,12 @@
 from seg.utils.registry import Registry, build_from_cfg
 
 TRANSFORMS = Registry('transform')
+CACHES = Registry('cache')
 
 
 def build_transform(cfg):
     return build_from_cfg(cfg, TRANSFORMS)
+
+
+def build_cache(cfg, default_args=None):
+    return build_from_cfg(cfg, CACHES, default_args)
@@ -0,0 +1,121 @@
+import os
+import pickle
+import hashlib
+import numpy as np
+import torch
+from .builder import CACHES
+
+
+def data_nbytes(data):
+    """统计样本字典中数组/张量占用的字节数."""
+    if isinstance(data, np.ndarray):
+        return data.nbytes
+    elif isinstance(data, torch.Tensor):
+        return data.element_size() * data.nelement()
+    elif isinstance(data, dict):
+        return sum(data_nbytes(v) for v in data.values())
+    elif isinstance(data, (list, tuple)):
+        return sum(data_nbytes(v) for v in data)
+    return 0
+
+
+def copy_data(data):
+    """拷贝样本, 避免后续随机变换原地修改缓存中的数组."""
+    if isinstance(data, np.ndarray):
+        return data.copy()
+    elif isinstance(data, torch.Tensor):
+        return data.clone()
+    elif isinstance(data, dict):
+        return {k: copy_data(v) for k, v in data.items()}
+    elif isinstance(data, (list, tuple)):
+        return type(data)(copy_data(v) for v in data)
+    return data
+
+
+@CACHES.register_module()
+class MemoryCache:
+    """In-process cache of pipeline outputs.
+
+    Every DataLoader worker owns its own copy, so ``max_bytes`` is a per-process
+    budget. Entries are never evicted: once the budget is spent new samples are
+    simply not cached, which beats LRU under the random access of a shuffled epoch.
+    Use it with ``persistent_workers=True``, otherwise the workers and their caches
+    are rebuilt every epoch.
+
+    Args:
+        max_bytes (int): Byte budget of the cache. Defaults to 4 GB.
+    """
+
+    def __init__(self, max_bytes=4 * 1024 ** 3):
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self._data = dict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        data = self._data.get(key, None)
+        return None if data is None else copy_data(data)
+
+    def put(self, key, data):
+        nbytes = data_nbytes(data)
+        if key in self._data or self.used_bytes + nbytes > self.max_bytes:
+            return False
+        self._data[key] = copy_data(data)
+        self.used_bytes += nbytes
+        return True
+
+
+@CACHES.register_module()
+class DiskCache:
+    """On-disk cache of pipeline outputs shared by all DataLoader workers.
+
+    Entries are pickled to ``cache_dir/<key>.pkl`` through a temporary file and
+    ``os.replace``, so concurrent workers never read a partial entry. The byte
+    budget is checked against the directory size found at start-up plus what
+    this process wrote, i.e. it is approximate when several workers write.
+
+    Args:
+        cache_dir (str): Directory of the cache files.
+        max_bytes (int): Byte budget of the cache. Defaults to 32 GB.
+    """
+
+    def __init__(self, cache_dir, max_bytes=32 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self.used_bytes = sum(
+            os.path.getsize(os.path.join(cache_dir, f)) for f in os.listdir(cache_dir) if f.endswith('.pkl'))
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.pkl')
+
+    def get(self, key):
+        path = self._path(key)
+        if not os.path.isfile(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except (EOFError, pickle.UnpicklingError):
+            return None
+
+    def put(self, key, data):
+        path = self._path(key)
+        if os.path.isfile(path):
+            return False
+        buf = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        if self.used_bytes + len(buf) > self.max_bytes:
+            return False
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(buf)
+        os.replace(tmp_path, path)
+        self.used_bytes += len(buf)
+        return True
+
+
+def cache_key(*items):
+    """将样本标识与前缀配置签名拼接后求哈希, 作为缓存的 key."""
+    return hashlib.sha1('|'.join(str(i) for i in items).encode('utf-8')).hexdigest()
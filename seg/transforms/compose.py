@@ -1,26 +1,98 @@
-from .builder import build_transform
+import json
+import time
+import numpy as np
+import torch
+from prettytable import PrettyTable
+from .builder import TRANSFORMS, build_transform, build_cache
+from .cache import cache_key
+
+TIMING_KEY = 'timing'
+# 仅在变换之间传递, 不进入 collate 的字段
+TRANSIENT_KEYS = ('fg_index', 'target_size')
+TIMING_TARGETS = ['total', 'image', 'mask']
+
 
 class Compose:
-    def __init__(self, transforms):
+    def __init__(self, transforms, cache=None, timing=False):
         """
         按顺序组合多个图像增强变换。
         参数：transforms (Sequence[dict | callable])：要组合的变换对象或配置字典的序列
+             cache (dict, optional): 确定性前缀的缓存配置, 例如 dict(type='MemoryCache', max_bytes=...)
+                 或 dict(type='DiskCache', cache_dir=..., max_bytes=...). 为 None 时不缓存.
+             timing (bool): 是否记录每个变换及每个目标(image/mask)的耗时. 开启后输出字典中会多一个
+                 'timing' 张量 [num_transforms, 3], 经 DataLoader collate 后由 TimingStatistics 汇总.
         """
         self.transforms = []
         self.transforms_dict = dict()
+        self.transforms_cfg = []
         for transform in transforms:
             if isinstance(transform, dict):
+                self.transforms_cfg.append(transform)
                 transform = build_transform(transform)
                 self.transforms.append(transform)
                 name = transform.__class__.__name__
                 self.transforms_dict[name] = transform
             elif callable(transform):
+                self.transforms_cfg.append(dict(type=transform.__class__.__name__, args=getattr(transform, '__dict__', {})))
                 self.transforms.append(transform)
                 name = transform.__class__.__name__
                 self.transforms_dict[name] = transform
             else:
                 raise TypeError('transform must be callable or dict')
 
+        # 在第一个随机变换处切分: 前缀的输出只与样本有关, 可以缓存
+        self.num_deterministic = len(self.transforms)
+        for i, t in enumerate(self.transforms):
+            if not getattr(t, 'deterministic', False):
+                self.num_deterministic = i
+                break
+        self.prefix_signature = cache_key(
+            json.dumps(self.transforms_cfg[:self.num_deterministic], sort_keys=True, default=str))
+        self.cache = None if cache is None else build_cache(cache)
+        self.timing = timing
+        self.names = [f'{i}.{t.__class__.__name__}' for i, t in enumerate(self.transforms)]
+
+    @property
+    def prefix(self):
+        return self.transforms[:self.num_deterministic]
+
+    @property
+    def suffix(self):
+        return self.transforms[self.num_deterministic:]
+
+    def _apply(self, transforms, data, offset=0, timing=None):
+        if timing is None:
+            for t in transforms:
+                data = t(**data)
+                if data is None:
+                    return None
+            return data
+
+        for i, t in enumerate(transforms, offset):
+            row = timing[i]
+            if hasattr(t, 'timer'):
+                t.timer = row
+            t0 = time.perf_counter()
+            data = t(**data)
+            row[0] += time.perf_counter() - t0
+            if hasattr(t, 'timer'):
+                t.timer = None
+            if data is None:
+                return None
+        return data
+
+    def _new_timing(self):
+        return np.zeros((len(self.transforms), len(TIMING_TARGETS)), dtype=np.float64) if self.timing else None
+
+    def _finalize(self, data, timing):
+        if data is None:
+            return None
+        for key in TRANSIENT_KEYS:
+            data.pop(key, None)
+        if timing is not None:
+            data[TIMING_KEY] = torch.from_numpy(timing)
+        return data
+
     def __call__(self, **data):
         """调用函数以按顺序应用图像增强变换.
         参数:
@@ -29,11 +101,114 @@ class Compose:
         Returns:
            dict: 序列应用后的字典格式.
         """
-        for t in self.transforms:
-            data = t(**data)
+        timing = self._new_timing()
+        return self._finalize(self._apply(self.transforms, data, timing=timing), timing)
+
+    def cached_call(self, key, load_fn, *args):
+        """带缓存地加载样本并应用变换.
+        参数:
+            key (str): 样本的唯一标识, 与前缀配置签名一起组成缓存的 key.
+            load_fn (callable): 缓存未命中时加载样本(解码, 标注转 mask 等)的函数, 返回 dict.
+            args: 传给 load_fn 的参数.
+
+        Returns:
+           dict: 序列应用后的字典格式.
+        """
+        timing = self._new_timing()
+        if self.cache is None or self.num_deterministic == 0:
+            return self._finalize(self._apply(self.transforms, load_fn(*args), timing=timing), timing)
+
+        key = cache_key(key, self.prefix_signature)
+        data = self.cache.get(key)
+        if data is None:
+            data = self._apply(self.prefix, load_fn(*args), timing=timing)
             if data is None:
                 return None
-        return data
+            self.cache.put(key, data)
+        data = self._apply(self.suffix, data, offset=self.num_deterministic, timing=timing)
+        return self._finalize(data, timing)
 
     def __getitem__(self, key):
         return self.transforms_dict[key]
+
+
+class BatchCompose:
+    def __init__(self, transforms, mean=None, std=None, device='cpu'):
+        """
+        collate 之后对整个 batch 做向量化的数据增强.
+        参数：transforms (Sequence[dict | callable]): 变换或配置字典. 配置中的 type 优先解析为 'Batch' + type,
+                 因此逐样本阶段的配置(如 {"type": "ColorJitter", ...})可以原样移动到 batch 阶段.
+             mean, std (Sequence[float], optional): Normalize 使用的均值和方差. 给定时先把图像还原到 [0, 1]
+                 再做增强, 最后重新归一化.
+             device (str): 'cpu' 表示在主进程中 .cuda() 之前执行, 否则在训练设备上执行.
+        """
+        self.transforms = []
+        for transform in transforms:
+            if isinstance(transform, dict):
+                transform = transform.copy()
+                if 'Batch' + transform['type'] in TRANSFORMS:
+                    transform['type'] = 'Batch' + transform['type']
+                transform = build_transform(transform)
+            elif not callable(transform):
+                raise TypeError('transform must be callable or dict')
+            self.transforms.append(transform)
+        self.mean = None if mean is None else torch.tensor(mean, dtype=torch.float32).view(1, -1, 1, 1)
+        self.std = None if std is None else torch.tensor(std, dtype=torch.float32).view(1, -1, 1, 1)
+        if self.mean is not None and self.mean.max() > 1:
+            self.mean, self.std = self.mean / 255, self.std / 255
+        self.on_device = device != 'cpu'
+
+    def __call__(self, **data):
+        image = data['image'].float()
+        if self.mean is not None:
+            mean, std = self.mean.to(image.device), self.std.to(image.device)
+            image = image * std + mean
+        data['image'] = image
+        for t in self.transforms:
+            data = t(**data)
+        if self.mean is not None:
+            data['image'] = (data['image'] - mean) / std
+        return data
+
+
+class TimingStatistics:
+    """汇总 Compose 输出的逐样本耗时, 统计 p50/p95/p99.
+
+    DataLoader 的每个 worker 都把计时结果随样本一起返回, collate 之后在主进程里
+    调用 ``update``, 因此统计结果天然覆盖了所有 worker.
+    """
+
+    def __init__(self, names):
+        self.names = names
+        self.records = []
+
+    def reset(self):
+        self.records = []
+
+    def update(self, timing):
+        """timing (Tensor): [B, num_transforms, 3], 单位秒."""
+        self.records.append(np.asarray(timing, dtype=np.float64).reshape(-1, len(self.names), len(TIMING_TARGETS)))
+
+    def summary(self):
+        """Returns: dict[str, ndarray]: 每个变换的 [3 targets, (p50, p95, p99, mean)], 单位毫秒."""
+        if len(self.records) == 0:
+            return {}
+        records = np.concatenate(self.records, axis=0) * 1000
+        quantiles = np.percentile(records, [50, 95, 99], axis=0)  # [3, N, T]
+        stats = np.concatenate([quantiles, records.mean(axis=0, keepdims=True)], axis=0)
+        return {name: stats[:, i, :].T for i, name in enumerate(self.names)}
+
+    def log(self, logger):
+        summary = self.summary()
+        if len(summary) == 0:
+            return
+        table = PrettyTable()
+        table.field_names = ["transform", "target", "p50(ms)", "p95(ms)", "p99(ms)", "mean(ms)"]
+        for name, stats in summary.items():
+            for target, values in zip(TIMING_TARGETS, stats):
+                if target != 'total' and values[-1] == 0:
+                    continue
+                table.add_row([name, target] + [round(float(v), 3) for v in values])
+        logger.info(f"Transform timing over {sum(len(r) for r in self.records)} samples")
+        for msg in table.__str__().split('\n'):
+            logger.info(msg)
@@ -6,4 +6,5 @@ from .weight_init import *
 from .io import *
 from .distribute import *
 from .config import *
-from .gpu import *
\ No newline at end of file
+from .gpu import *
+from .ema import *
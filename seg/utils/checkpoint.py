@@ -1,5 +1,10 @@
 import os
 import time
+import random
+import queue
+import logging
+import threading
+import numpy as np
 import torch
 import pickle
 from collections import OrderedDict
@@ -65,17 +70,50 @@ def weights_to_cpu(state_dict):
     return state_dict_cpu
 
 
-def save_checkpoint(model, filename, optimizer=None, lr_scheduler=None,
-                    meta=None):
-    """Save checkpoint to file.
-    The checkpoint will have 3 fields: ``meta``, ``state_dict`` and
-    ``optimizer``. By default ``meta`` will contain version and time info.
-    Args:
-        model (Module): Module whose params are to be saved.
-        filename (str): Checkpoint filename.
-        optimizer (:obj:`Optimizer`, optional): Optimizer to be saved.
-        lr_scheduler (:obj:`_LRScheduler`, optional): _LRScheduler to be saved.
-        meta (dict, optional): Metadata to be saved in checkpoint.
+def snapshot_to_cpu(data):
+    """Recursively copy the tensors of a (state) dict to cpu.
+
+    Unlike ``weights_to_cpu`` it also copies tensors that are already on cpu, so
+    the snapshot does not change while training keeps updating the live tensors
+    (e.g. the optimizer state) in place.
+    """
+    if isinstance(data, Tensor):
+        return data.detach().to('cpu', copy=True)
+    elif isinstance(data, dict):
+        return type(data)((key, snapshot_to_cpu(value)) for key, value in data.items())
+    elif isinstance(data, (list, tuple)):
+        return type(data)(snapshot_to_cpu(value) for value in data)
+    return data
+
+
+def get_rng_state():
+    """Random states of python, numpy and torch (cpu and every visible cuda device)."""
+    state = {
+        'python': random.getstate(),
+        'numpy': np.random.get_state(),
+        'torch': torch.get_rng_state(),
+    }
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    """Restore the random states returned by :func:`get_rng_state`."""
+    random.setstate(state['python'])
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'])
+    if 'cuda' in state and torch.cuda.is_available():
+        cuda_state = state['cuda'][:torch.cuda.device_count()]
+        for device, device_state in enumerate(cuda_state):
+            torch.cuda.set_rng_state(device_state, device)
+
+
+def checkpoint_state(model, optimizer=None, lr_scheduler=None, meta=None, extra=None):
+    """Build the checkpoint dict written by :func:`save_checkpoint` as a cpu snapshot.
+
+    ``model`` may also be a ``state_dict`` that was already snapshotted. ``extra`` holds further top-level entries of the checkpoint, e.g. the grad
+    scaler, random states or sampler state needed to resume training.
     """
     if meta is None:
         meta = {}
@@ -84,22 +122,134 @@ def save_checkpoint(model, filename, optimizer=None, lr_scheduler=None,
             type(meta)))
     meta.update(time=time.asctime())
 
-    file_dir = os.path.dirname(filename)
-    if not os.path.exists(file_dir):
-        os.mkdir(file_dir)
-
     if hasattr(model, 'module'):
         model = model.module
+    state_dict = model if isinstance(model, dict) else model.state_dict()
 
     checkpoint = {
         'meta': meta,
-        'state_dict': weights_to_cpu(model.state_dict())
+        'state_dict': snapshot_to_cpu(state_dict)
     }
     if optimizer is not None:
-        checkpoint['optimizer'] = optimizer.state_dict()
+        checkpoint['optimizer'] = snapshot_to_cpu(optimizer.state_dict())
     if lr_scheduler is not None:
         checkpoint['lr_scheduler'] = lr_scheduler.state_dict()
-    torch.save(checkpoint, filename)
+    if extra is not None:
+        checkpoint.update(snapshot_to_cpu(extra))
+    return checkpoint
+
+
+def atomic_save(checkpoint, filename):
+    """``torch.save`` to a temporary file and rename it, readers never see a partial file."""
+    file_dir = os.path.dirname(filename)
+    if file_dir and not os.path.exists(file_dir):
+        os.makedirs(file_dir, exist_ok=True)
+    tmp_filename = f'{filename}.{os.getpid()}.tmp'
+    try:
+        torch.save(checkpoint, tmp_filename)
+        os.replace(tmp_filename, filename)
+    finally:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+
+
+def save_checkpoint(model, filename, optimizer=None, lr_scheduler=None,
+                    meta=None, extra=None):
+    """Save checkpoint to file.
+    The checkpoint will have 3 fields: ``meta``, ``state_dict`` and
+    ``optimizer``. By default ``meta`` will contain version and time info.
+    Args:
+        model (Module): Module whose params are to be saved.
+        filename (str): Checkpoint filename.
+        optimizer (:obj:`Optimizer`, optional): Optimizer to be saved.
+        lr_scheduler (:obj:`_LRScheduler`, optional): _LRScheduler to be saved.
+        meta (dict, optional): Metadata to be saved in checkpoint.
+        extra (dict, optional): Further entries to be saved in checkpoint.
+    """
+    atomic_save(checkpoint_state(model, optimizer, lr_scheduler, meta, extra), filename)
+
+
+class CheckpointWriter:
+    """Write checkpoints from a background thread with retention policies.
+
+    ``save`` only snapshots the state to cpu on the calling thread; serialization
+    and disk I/O run on a worker thread, through :func:`atomic_save`. Checkpoints
+    saved with a ``score`` compete for the ``keep_best`` slots (higher is better),
+    the others are kept as the ``keep_last`` most recent ones. Files outside the
+    retention are deleted once a newer checkpoint is on disk.
+
+    Args:
+        keep_last (int): Number of recent checkpoints to keep, 0 keeps all.
+        keep_best (int): Number of best checkpoints to keep, 0 keeps all.
+        async_write (bool): Whether to write in the background. Defaults to True.
+    """
+
+    def __init__(self, keep_last=1, keep_best=1, async_write=True):
+        self.keep_last = keep_last
+        self.keep_best = keep_best
+        self.async_write = async_write
+        self.last_files = []
+        self.best_files = []  # (score, filename)
+        self.queue = queue.Queue()
+        self.thread = None
+        if async_write:
+            self.thread = threading.Thread(target=self._run, name='CheckpointWriter', daemon=True)
+            self.thread.start()
+
+    def save(self, model, filename, optimizer=None, lr_scheduler=None, meta=None, score=None, extra=None):
+        t0 = time.time()
+        checkpoint = checkpoint_state(model, optimizer, lr_scheduler, meta, extra)
+        snapshot_time = time.time() - t0
+        if self.async_write:
+            self.queue.put((checkpoint, filename, score))
+        else:
+            self._write(checkpoint, filename, score)
+        return snapshot_time
+
+    def _write(self, checkpoint, filename, score):
+        t0 = time.time()
+        atomic_save(checkpoint, filename)
+        logging.getLogger().info(f"Wrote checkpoint {filename} in {time.time() - t0:.2f} sec")
+        self._retain(filename, score)
+
+    def _retain(self, filename, score):
+        if score is None:
+            if filename in self.last_files:
+                self.last_files.remove(filename)
+            self.last_files.append(filename)
+            removed = self.last_files[:-self.keep_last] if self.keep_last > 0 else []
+            self.last_files = self.last_files[len(removed):]
+        else:
+            self.best_files = [b for b in self.best_files if b[1] != filename] + [(score, filename)]
+            self.best_files.sort(key=lambda b: b[0], reverse=True)
+            removed = [b[1] for b in self.best_files[self.keep_best:]] if self.keep_best > 0 else []
+            self.best_files = self.best_files[:len(self.best_files) - len(removed)]
+        kept = set(self.last_files) | set(b[1] for b in self.best_files)
+        for f in removed:
+            if f not in kept and os.path.exists(f):
+                os.remove(f)
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                self._write(*item)
+            except Exception as e:
+                logging.getLogger().error(f"Write checkpoint {item[1]} failed! {e}")
+            finally:
+                self.queue.task_done()
+
+    def wait(self):
+        """Block until all queued checkpoints are on disk."""
+        if self.async_write:
+            self.queue.join()
+
+    def close(self):
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
 
 
 def load_checkpoint(model, filename, map_location=None, strict=False):
@@ -8,13 +8,42 @@ def cuda_is_available():
 def devices_count():
     return torch.cuda.device_count()
 
+def get_local_rank():
+    return int(os.environ.get('LOCAL_RANK', 0))
+
+
 def init_dist_pytorch(**kwargs):
-    # rank = kwargs.get('rank', 0)
-    # num_gpus = torch.cuda.device_count()
-    # torch.cuda.set_device(rank % num_gpus)
+    """初始化进程组.
+
+    由 torchrun 启动时(环境变量中有 RANK/WORLD_SIZE)使用 env:// 初始化, 忽略配置中的 rank/world_size.
+    没有 cuda 时 nccl 自动换成 gloo, 因此同一份配置可以在单机 CPU 上用 torchrun 调试.
+    """
+    kwargs = dict(kwargs)
+    if 'RANK' in os.environ and 'WORLD_SIZE' in os.environ:
+        kwargs.pop('rank', None)
+        kwargs.pop('world_size', None)
+        kwargs['init_method'] = 'env://'
+    if not cuda_is_available():
+        kwargs['backend'] = 'gloo'
+    else:
+        kwargs.setdefault('backend', 'nccl')
+        torch.cuda.set_device(get_local_rank() % devices_count())
     dist.init_process_group(**kwargs)
 
 
+def is_main_process():
+    return get_dist_info()[0] == 0
+
+
+def broadcast_object(obj, src=0):
+    """把 src 上的可序列化对象广播到所有进程, 未初始化分布式时原样返回."""
+    if not is_dist_avail_and_initialized():
+        return obj
+    objects = [obj]
+    dist.broadcast_object_list(objects, src=src)
+    return objects[0]
+
+
 def get_dist_info():
     if dist.is_available():
         initialized = dist.is_initialized()
@@ -47,4 +76,27 @@ def reduce_value(value, average=True):
         dist.all_reduce(value)
         if average:
             value /= world_size
-        return value
\ No newline at end of file
+        return value
+
+
+def reduce_flag(flag, device):
+    """所有 rank 的 bool 取或 (all_reduce MAX), 任一 rank 为 True 时所有 rank 都返回 True."""
+    if not is_dist_avail_and_initialized():
+        return flag
+    value = torch.tensor(int(flag), device=device)
+    dist.all_reduce(value, op=dist.ReduceOp.MAX)
+    return bool(value.item())
+
+
+def reduce_scalars(scalars, average=True):
+    """把多个标量张量打包成一个张量, 只做一次 all_reduce 和一次设备到主机的拷贝.
+
+    参数: scalars (dict[str, Tensor]): 同一设备上的标量张量.
+    返回: dict[str, float]
+    """
+    if len(scalars) == 0:
+        return {}
+    keys = list(scalars)
+    packed = torch.stack([scalars[key].detach().float().reshape(()) for key in keys])
+    packed = reduce_value(packed, average=average)
+    return dict(zip(keys, packed.tolist()))
@@ -0,0 +1,82 @@
+import copy
+import math
+import torch
+
+
+class ModelEMA:
+    """Exponential moving average of the model weights.
+
+    The averaged copy ``module`` is updated with one ``torch._foreach_mul_`` and
+    one ``torch._foreach_add_`` over all floating point parameters and buffers
+    instead of a Python loop of per-tensor ops; integer buffers (e.g.
+    ``num_batches_tracked``) are copied. With ``interval`` k the average is only
+    updated every k optimizer steps with decay ``decay ** k``, so the time
+    horizon stays the same. ``tau`` ramps the decay up from 0 during the first
+    updates, ``decay * (1 - exp(-updates / tau))``, so the average does not stay
+    close to the initial weights; 0 disables the ramp.
+
+    Args:
+        model (Module): Model to average, may be wrapped by DDP.
+        decay (float): Decay per optimizer step. Defaults to 0.9999.
+        interval (int): Update every ``interval`` optimizer steps. Defaults to 1.
+        tau (float): Steps of the decay warmup. Defaults to 2000.
+    """
+
+    def __init__(self, model, decay=0.9999, interval=1, tau=2000):
+        model = model.module if hasattr(model, 'module') else model
+        self.module = copy.deepcopy(model).eval()
+        # 编译后的 forward 绑定在原模型上, EMA 模型使用 eager 的 forward
+        self.module.__dict__.pop('forward', None)
+        for p in self.module.parameters():
+            p.requires_grad_(False)
+        self.decay = decay
+        self.interval = max(interval, 1)
+        self.tau = tau
+        self.steps = 0
+        self.updates = 0
+        self._float_pairs = None
+
+    @staticmethod
+    def _tensors(module):
+        return list(module.parameters()) + list(module.buffers())
+
+    def _pairs(self, model):
+        if self._float_pairs is None:
+            ema_float, model_float, self._other_pairs = [], [], []
+            for ema_v, v in zip(self._tensors(self.module), self._tensors(model)):
+                if ema_v.dtype.is_floating_point:
+                    ema_float.append(ema_v)
+                    model_float.append(v)
+                else:
+                    self._other_pairs.append((ema_v, v))
+            self._float_pairs = (ema_float, model_float)
+        return self._float_pairs
+
+    def get_decay(self):
+        decay = self.decay ** self.interval
+        if self.tau > 0:
+            decay *= 1 - math.exp(-self.updates * self.interval / self.tau)
+        return decay
+
+    @torch.no_grad()
+    def update(self, model):
+        """Call after every optimizer step, the average is updated every ``interval`` calls."""
+        self.steps += 1
+        if self.steps % self.interval != 0:
+            return
+        self.updates += 1
+        model = model.module if hasattr(model, 'module') else model
+        ema_float, model_float = self._pairs(model)
+        decay = self.get_decay()
+        torch._foreach_mul_(ema_float, decay)
+        torch._foreach_add_(ema_float, model_float, alpha=1 - decay)
+        for ema_v, v in self._other_pairs:
+            ema_v.copy_(v)
+
+    def state_dict(self):
+        return {'state_dict': self.module.state_dict(), 'steps': self.steps, 'updates': self.updates}
+
+    def load_state_dict(self, state_dict):
+        self.module.load_state_dict(state_dict['state_dict'])
+        self.steps = state_dict['steps']
+        self.updates = state_dict['updates']
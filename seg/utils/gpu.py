@@ -1,4 +1,7 @@
+import sys
+import resource
 import subprocess
+import torch
 
 def get_gpu_memroy(gpu_id:set = None):
 
@@ -11,4 +14,25 @@ def get_gpu_memroy(gpu_id:set = None):
         memory_used, memory_total = map(lambda x: int(x.split(" ")[0]), line.split(", "))
         info = dict(gpu_id=i, memory_used=memory_used, memory_total=memory_total)
         memeory_info.append(info)
-    return memeory_info
\ No newline at end of file
+    return memeory_info
+
+def get_rss():
+    """Current resident set size of this process in bytes, the peak where /proc is missing."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (OSError, IndexError, ValueError):
+        return get_peak_memory('cpu')
+
+def get_peak_memory(device):
+    """Peak memory of this process in bytes.
+
+    On CUDA it is the peak of the torch caching allocator since the last
+    ``torch.cuda.reset_peak_memory_stats``, otherwise the peak resident set size.
+    """
+    device = torch.device(device)
+    if device.type == 'cuda':
+        return torch.cuda.max_memory_allocated(device)
+    # ru_maxrss 在 Linux 上单位为 KB, 在 macOS 上为 B
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
@@ -82,6 +82,29 @@ def annotation2mask(annotation: dict, class2label_dict: dict, min_pixel=2):
 
     return mask
 
+def annotation2boxes(annotation: dict, class2label_dict: dict, min_pixel=2):
+    """
+    由标注直接计算每个类别的目标外接框, 不需要扫描 mask.
+    返回: dict, key 为标签名字, value 为 ndarray[K, 4], 每行是按图像宽高归一化的 (x1, y1, x2, y2).
+    过滤规则与 annotation2mask 保持一致.
+    """
+    width, height = float(annotation["width"]), float(annotation["height"])
+    boxes = dict()
+    for k, shape in annotation["shapes"].items():
+        if not class2label_dict.get(shape.get("label", None), 0):
+            continue  # 未知标签与背景不建索引
+        tmp_points = np.int0((shape["points"]))
+        points = np.zeros((len(tmp_points)//2, 2), dtype=np.int32)
+        points[:, 0] = tmp_points[0::2]
+        points[:, 1] = tmp_points[1::2]
+        if len(points) <= 2: continue
+        if cv2.contourArea(points) < min_pixel: continue
+        x1, y1 = points.min(axis=0)
+        x2, y2 = points.max(axis=0)
+        boxes.setdefault(shape["label"], []).append([x1 / width, y1 / height, x2 / width, y2 / height])
+    return {name: np.clip(np.array(b, dtype=np.float32), 0., 1.) for name, b in boxes.items()}
+
+
 def read_image(ip:str, mode:str="BGR"):
     if not ope(ip):
         raise FileNotFoundError(f"image file {ip} not found")
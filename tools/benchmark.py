@@ -0,0 +1,177 @@
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../'))
+
+import copy
+import time
+import torch
+from prettytable import PrettyTable
+from seg.models.registry import build_segmentation
+from seg.utils.config import file_to_config
+
+# (名称, channels_last, compile)
+MODES = [
+    ('eager', False, False),
+    ('channels_last', True, False),
+    ('compile', False, True),
+    ('channels_last+compile', True, True),
+]
+# backbone.with_checkpoint 的对比配置 (名称, 每个 stage 是否重算)
+CHECKPOINT_MODES = [
+    ('none', [False, False, False, False]),
+    ('stage1-2', [True, True, False, False]),
+    ('stage3', [False, False, True, False]),
+    ('all', [True, True, True, True]),
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark channels_last, torch.compile and activation checkpointing.')
+    parser.add_argument('--cfg', type=str, default='/workspace/mycode/03-seg/seg/config/train.json')
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--iters', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--device', type=str, default='cpu')
+    # 对比 MogaNet 各 stage 的 with_checkpoint: 训练吞吐与反向保存的激活/峰值显存
+    parser.add_argument('--with-checkpoint', action='store_true')
+    args = parser.parse_args()
+    return args
+
+
+def build_model(model, channels_last, compile):
+    model = copy.deepcopy(model)
+    if channels_last:
+        model.to(memory_format=torch.channels_last)
+    if compile:
+        model.forward = torch.compile(model.forward)
+    return model
+
+
+def to_memory_format(image, channels_last):
+    return image.contiguous(memory_format=torch.channels_last) if channels_last else image
+
+
+def synchronize(device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+
+
+def benchmark_infer(model, image, iters, warmup):
+    model.eval()
+    with torch.no_grad():
+        for i in range(warmup + iters):
+            if i == warmup:
+                synchronize(image.device)
+                t0 = time.perf_counter()
+            model(image)
+    synchronize(image.device)
+    return iters * image.shape[0] / (time.perf_counter() - t0)
+
+
+def benchmark_train(model, image, mask, iters, warmup):
+    model.train()
+    optimizer = torch.optim.SGD(model.parameters(), lr=1e-4, momentum=0.9)
+    for i in range(warmup + iters):
+        if i == warmup:
+            synchronize(image.device)
+            t0 = time.perf_counter()
+        losses = model(image, return_metrics=True, ground_truth=mask)
+        losses['loss'].backward()
+        optimizer.step()
+        optimizer.zero_grad()
+    synchronize(image.device)
+    return iters * image.shape[0] / (time.perf_counter() - t0)
+
+
+def saved_activation_bytes(model, image, mask):
+    """一次训练前向中为反向保存的张量字节数 (按 storage 去重, 不含参数), 与设备无关."""
+    model.train()
+    params = set(p.untyped_storage().data_ptr() for p in model.parameters())
+    storages = dict()
+
+    def pack(t):
+        ptr = t.untyped_storage().data_ptr()
+        if ptr not in params:
+            storages[ptr] = t.untyped_storage().nbytes()
+        return t
+
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda t: t):
+        losses = model(image, return_metrics=True, ground_truth=mask)
+    losses['loss'].backward()
+    model.zero_grad()
+    return sum(storages.values())
+
+
+def peak_memory(device, fn):
+    if device.type != 'cuda':
+        return None
+    torch.cuda.reset_peak_memory_stats(device)
+    fn()
+    return torch.cuda.max_memory_allocated(device)
+
+
+def benchmark_checkpoint(model_cfg, image, mask, args):
+    device = image.device
+    table = PrettyTable()
+    table.field_names = ['with_checkpoint', 'train (img/s)', 'speed', 'saved act (MB)', 'act ratio', 'peak (MB)']
+    base = None
+    for name, with_checkpoint in CHECKPOINT_MODES:
+        cfg = copy.deepcopy(model_cfg)
+        cfg['backbone']['with_checkpoint'] = with_checkpoint
+        torch.manual_seed(0)
+        model = build_segmentation(cfg).to(device)
+        saved = saved_activation_bytes(model, image, mask)
+        peak = peak_memory(device, lambda: benchmark_train(model, image, mask, 1, 0))
+        train = benchmark_train(model, image, mask, args.iters, args.warmup)
+        if base is None:
+            base = (train, saved)
+        table.add_row([name, f'{train:.1f}', f'{train / base[0]:.2f}x', f'{saved / 1024 ** 2:.1f}',
+                       f'{saved / max(base[1], 1):.2f}x', '-' if peak is None else f'{peak / 1024 ** 2:.1f}'])
+        print(f'{name} done.')
+    return table
+
+
+def main():
+    args = parse_args()
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    cfg = file_to_config(args.cfg)
+    model_cfg = cfg['inference']['model'].copy()
+    model_cfg['pretrained'] = None
+    height, width = cfg['inference']['transform'][0]['height'], cfg['inference']['transform'][0]['width']
+    num_classes = model_cfg['decoder_head']['num_classes']
+
+    device = torch.device(args.device)
+    image = torch.randn(args.batch_size, 3, height, width, device=device)
+    mask = torch.randint(0, max(num_classes, 2), (args.batch_size, height, width), device=device)
+    if args.with_checkpoint:
+        table = benchmark_checkpoint(model_cfg, image, mask, args)
+        print(f'device: {device}, cpu threads: {torch.get_num_threads()}, batch size: {args.batch_size}, '
+              f'input: {height}x{width}')
+        print(table)
+        return
+
+    torch.manual_seed(0)
+    model = build_segmentation(model_cfg).to(device)
+
+    table = PrettyTable()
+    table.field_names = ['mode', 'infer (img/s)', 'infer speedup', 'train (img/s)', 'train speedup']
+    base = None
+    for name, channels_last, compile in MODES:
+        x = to_memory_format(image, channels_last)
+        infer = benchmark_infer(build_model(model, channels_last, compile), x, args.iters, args.warmup)
+        train = benchmark_train(build_model(model, channels_last, compile), x, mask, args.iters, args.warmup)
+        if base is None:
+            base = (infer, train)
+        table.add_row([name, f'{infer:.1f}', f'{infer / base[0]:.2f}x', f'{train:.1f}', f'{train / base[1]:.2f}x'])
+        print(f'{name} done.')
+    print(f'device: {device}, cpu threads: {torch.get_num_threads()}, batch size: {args.batch_size}, '
+          f'input: {height}x{width}')
+    print(table)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,9 @@
 import argparse
 import os
 
-os.environ['CUDA_VISIBLE_DEVICES'] = '0'
+# torchrun 启动时每个进程通过 LOCAL_RANK 选择自己的 GPU, 不能只暴露 0 号卡
+if 'LOCAL_RANK' not in os.environ:
+    os.environ['CUDA_VISIBLE_DEVICES'] = '0'
 import sys
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../'))
@@ -15,6 +17,8 @@ def parse_args():
     parser = argparse.ArgumentParser()
     # parser.add_argument('--cfg', type=str, default='/workspace/mycode/03-seg/seg/config/train.json')
     parser.add_argument('--cfg', type=str, default='/workspace/mycode/03-seg/seg/config/train-v1.json')
+    # 从 *_last_epoch*.pth 断点续训, 覆盖 data.resume
+    parser.add_argument('--resume', type=str, default=None)
     # parser.add_argument('--cfg', type=str, default='C:\mycode\mycode\seg\config\\train_local.json')
     args = parser.parse_args()
     return args
@@ -25,8 +29,13 @@ def main():
     cfg_path = args.cfg
     cfg = file_to_config(cfg_path)
     common_cfg = cfg['common']
+    if int(os.environ.get('WORLD_SIZE', 1)) > 1:
+        # torchrun --nproc_per_node N tools/train.py --cfg ..., 无 GPU 时自动使用 gloo
+        common_cfg['distribute'] = True
     inference_cfg = cfg['inference']
     train_cfg = cfg['data']
+    if args.resume is not None:
+        train_cfg['resume'] = args.resume
     export_cfg = cfg['export']
     train_runner = TrainRunner(export_cfg, train_cfg, inference_cfg, common_cfg)
     train_runner()